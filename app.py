@@ -1,13 +1,50 @@
-from flask import Flask
+from flask import Flask, jsonify, request, url_for
 import dart_bot  # your existing bot logic
+import jobs
+import webhook
 
 app = Flask(__name__)
 
 @app.route("/")
-def index():
-    # run your bot code when the service URL is hit
-    result = dart_bot.run()  # or whatever your entry function is
-    return f"Bot executed successfully: {result}", 200
+async def index():
+    # run your bot code when the service URL is hit; overlapping hits share one run.
+    # Flask runs an async view in its own event loop on the WSGI worker thread, so the
+    # thread stays busy for the whole run; triggers that should not tie up a worker
+    # use POST /runs instead.
+    outcome = await dart_bot.run_coordinated_async()
+    return (f"Bot executed successfully: {outcome['result']} "
+            f"(ran={outcome['ran']}, shared={outcome['shared']}, lock_wait={outcome['lock_wait']}s)"), 200
+
+@app.route("/runs", methods=["POST"])
+def start_run():
+    # start a background run and return immediately; poll GET /runs/<id> for progress
+    job, created = jobs.submit()
+    body = dict(job.to_dict(), created=created)
+    return jsonify(body), 202, {"Location": url_for("run_status", job_id=job.id)}
+
+@app.route("/runs/<job_id>")
+def run_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown run id"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route("/telegram", methods=["POST"])
+def telegram_webhook():
+    # acknowledge at once; the command is answered from local state on the webhook worker
+    # without a configured secret anyone could forge updates, so the route stays closed
+    secret = webhook.TELEGRAM_WEBHOOK_SECRET
+    if not secret:
+        return jsonify({"error": "TELEGRAM_WEBHOOK_SECRET is not configured"}), 403
+    if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+        return jsonify({"error": "forbidden"}), 403
+    update = request.get_json(silent=True)
+    if not isinstance(update, dict):
+        return jsonify({"error": "invalid update"}), 400
+    if not webhook.submit(update):
+        # Telegram redelivers updates answered with an error
+        return jsonify({"error": "busy"}), 503
+    return jsonify({"ok": True}), 200
 
 if __name__ == "__main__":
     import os
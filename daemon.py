@@ -0,0 +1,63 @@
+import asyncio
+import os
+import traceback
+from datetime import datetime, timedelta
+
+import dart_bot
+import http_client
+import krx_calendar
+
+# Resident polling mode: one process keeps its HTTP connections, filing cache and
+# state store warm and runs the bot incrementally in a loop, so most polls are a
+# single list.json request. The interval follows the KST disclosure day and
+# the KRX holiday calendar.
+#
+#   python daemon.py
+
+# (start hour, end hour, seconds between polls), KST, weekdays
+POLL_SCHEDULE = [
+    (0, 7, int(os.getenv("DAEMON_NIGHT_INTERVAL", "1800"))),
+    (7, 19, int(os.getenv("DAEMON_ACTIVE_INTERVAL", "60"))),
+    (19, 24, int(os.getenv("DAEMON_EVENING_INTERVAL", "600"))),
+]
+MAX_ERROR_BACKOFF = int(os.getenv("DAEMON_MAX_ERROR_BACKOFF", "600"))
+
+
+def next_poll_delay(now):
+    # Seconds until the next poll: the interval of the current bracket, cut short at
+    # the start of the next bracket; weekends and KRX holidays sleep until 00:00 KST
+    # of the next disclosure day
+    if not krx_calendar.is_disclosure_day(now.date()):
+        next_day = krx_calendar.next_disclosure_day(now.date())
+        wake = now.replace(year=next_day.year, month=next_day.month, day=next_day.day,
+                           hour=0, minute=0, second=0, microsecond=0)
+        return (wake - now).total_seconds()
+    for start, end, interval in POLL_SCHEDULE:
+        if start <= now.hour < end:
+            if end == 24:
+                boundary = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+            else:
+                boundary = now.replace(hour=end, minute=0, second=0, microsecond=0)
+            return max(1.0, min(interval, (boundary - now).total_seconds()))
+    return POLL_SCHEDULE[0][2]
+
+
+async def poll_forever():
+    errors = 0
+    async with http_client.AsyncClient() as client:
+        while True:
+            try:
+                # same lease as app.py, so the daemon never overlaps a triggered run
+                await dart_bot.run_coordinated_async(client=client, incremental=True)
+                errors = 0
+                delay = next_poll_delay(datetime.now(dart_bot.korea_tz))
+            except Exception:
+                traceback.print_exc()
+                errors += 1
+                delay = min(MAX_ERROR_BACKOFF, 30 * 2 ** (errors - 1))
+            print(f"Next poll in {delay:.0f}s")
+            await asyncio.sleep(delay)
+
+
+if __name__ == "__main__":
+    asyncio.run(poll_forever())
@@ -1,9 +1,21 @@
-import requests    
-import zipfile
-from io import BytesIO
+import asyncio
 import os
 import json
-from bs4 import BeautifulSoup
+import threading
+import time
+from contextlib import nullcontext
+
+import dart_quota
+import filing_archive
+import filing_cache
+import http_client
+import krx_calendar
+import resilience
+import run_lock
+import state
+import subscriptions
+import telegram_sender
+import filing_parser
 
 API_KEY = os.getenv("DART_API_KEY")
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -12,8 +24,40 @@ CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 if not API_KEY or not BOT_TOKEN or not CHAT_ID:
     from configs import API_KEY, BOT_TOKEN, CHAT_ID
 
-# File to store the last texts list
-LAST_TEXTS_FILE = "last_texts.json"
+# Incremental polling: per-day watermark of list.json filings already handled
+INCREMENTAL = os.getenv("DART_INCREMENTAL", "0") == "1"
+WATERMARK_FILE = "watermark.json"
+
+# Use bd_fta from the BW/CB/EB detail APIs as the amount and only download
+# document.xml for filings those APIs did not cover
+STRUCTURED_FAST_PATH = os.getenv("DART_STRUCTURED_FAST_PATH", "0") == "1"
+
+# Max in-flight BW/CB/EB detail requests (per-host cap is DART_POOL_SIZE in http_client)
+DETAIL_WORKERS = int(os.getenv("DART_DETAIL_WORKERS", "8"))
+DETAIL_URLS = [
+    "https://opendart.fss.or.kr/api/bdwtIsDecsn.json",
+    "https://opendart.fss.or.kr/api/cvbdIsDecsn.json",
+    "https://opendart.fss.or.kr/api/exbdIsDecsn.json",
+]
+
+# Max in-flight document.xml downloads; parsing runs in worker threads alongside them
+DOCUMENT_WORKERS = int(os.getenv("DART_DOCUMENT_WORKERS", "8"))
+DOCUMENT_URL = "https://opendart.fss.or.kr/api/document.xml"
+LIST_URL = "https://opendart.fss.or.kr/api/list.json"
+
+# Times a call is retried after DART answers '020' (rate limited); see dart_quota
+RATE_LIMIT_RETRIES = int(os.getenv("DART_RATE_LIMIT_RETRIES", "3"))
+# Start a duplicate document.xml download when one is slower than the recent p95; see resilience
+HEDGE_DOCUMENTS = os.getenv("DART_HEDGE_DOCUMENTS", "1") == "1"
+
+# digest: one cumulative message per run; alert: one message per filing as soon as
+# its amount is extracted (see run_alerts_async)
+RUN_MODE = os.getenv("DART_RUN_MODE", "digest")
+# Capacity of each queue between alert pipeline stages
+ALERT_QUEUE_SIZE = int(os.getenv("DART_ALERT_QUEUE_SIZE", "16"))
+
+# Filings whose report name contains any of these are not bond issuances to report
+FILTER_WORDS = ['정정', '감자', '증자', '선택권', '처분', '자기', '자본', '양수도', '소송', '합병', '분할']
 
 from datetime import datetime, timezone, timedelta
 
@@ -28,29 +72,52 @@ weekday_kr = {
     5: '(토)',
     6: '(일)'
 }
-def save_last_texts(texts):
+def save_last_texts(entries, chat_id=None):
+    # entries: [(rcept_no, report_type, amount)] just sent to chat_id (default CHAT_ID)
+    state.get_store().mark_sent(entries, chat_id=chat_id or CHAT_ID)
+
+def load_watermark(date_string):
+    # {'date', 'watermark': highest rcept_no seen, 'processed': set, 'pending': {rcept_no: item},
+    #  'parked': {rcept_no: item}} - pending filings are retried next run, parked (unparseable)
+    # ones only once their negative filing cache entry has expired
+    empty = {'date': date_string, 'watermark': '', 'processed': set(), 'pending': {}, 'parked': {}}
     try:
-        with open(LAST_TEXTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(texts, f, ensure_ascii=False, indent=2)
+        if os.path.exists(WATERMARK_FILE):
+            with open(WATERMARK_FILE, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('date') == date_string:
+                return {
+                    'date': date_string,
+                    'watermark': state.get('watermark', ''),
+                    'processed': set(state.get('processed', [])),
+                    'pending': state.get('pending', {}),
+                    'parked': state.get('parked', {}),
+                }
     except Exception as e:
-        print(f"Error saving last texts: {e}")
+        print(f"Error loading watermark: {e}")
+    return empty
 
-def load_last_texts():
+def save_watermark(state):
     try:
-        if os.path.exists(LAST_TEXTS_FILE):
-            with open(LAST_TEXTS_FILE, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
+        with open(WATERMARK_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'date': state['date'],
+                'watermark': state['watermark'],
+                'processed': sorted(state['processed']),
+                'pending': state['pending'],
+                'parked': state['parked'],
+            }, f, ensure_ascii=False, indent=2)
     except Exception as e:
-        print(f"Error loading last texts: {e}")
-    return []
+        print(f"Error saving watermark: {e}")
+
+def release_parked(watermark):
+    # Parked filings whose negative cache entry expired are retried with the pending ones
+    for rcept_no in list(watermark['parked']):
+        if filing_cache.get(rcept_no) is None:
+            watermark['pending'][rcept_no] = watermark['parked'].pop(rcept_no)
 
-def texts_are_same(texts1, texts2):
-    if not texts1 and not texts2: return True
-    if len(texts1) != len(texts2): return False
-    return texts1 == texts2
+def watermark_item(item):
+    return {k: item.get(k, '') for k in ('rcept_no', 'corp_code', 'corp_name', 'report_nm')}
 
 def process_data(data):
     result = []
@@ -65,14 +132,8 @@ def process_data(data):
         return result
     else: return False
 
-def textize(data, type):
-    if not data: return False
-    return f"- {data['corp_name']} {type} {round(float(data['bd_fta'].replace(',',''))/10**8,1)}억 \n https://dart.fss.or.kr/dsaf001/main.do?rcpNo={data['rcept_no']}\n"
-
-def get_dart_reports(start_date, end_date, page_no=1):
-    base_url = "https://opendart.fss.or.kr/api/list.json"
-    
-    params = {
+def list_params(start_date, end_date, page_no=1):
+    return {
         'crtfc_key': API_KEY,
         'bgn_de': start_date,
         'end_de': end_date,
@@ -80,38 +141,166 @@ def get_dart_reports(start_date, end_date, page_no=1):
         'pblntf_ty': 'B',
         'pblntf_detail_ty': 'B001',
         'page_no': page_no,
-        'page_count': "100"
+        'page_count': "100",
+        'sort': 'date',
+        'sort_mth': 'desc'
     }
-    response = requests.get(base_url, params=params)
-    return response.json()
-
-def get_dart_report_details(corp_code, date_string):
-    base_url_bw = "https://opendart.fss.or.kr/api/bdwtIsDecsn.json"
-    base_url_cb = "https://opendart.fss.or.kr/api/cvbdIsDecsn.json"
-    base_url_eb = "https://opendart.fss.or.kr/api/exbdIsDecsn.json"
 
-    params = {
+def detail_params(corp_code, date_string):
+    return {
         'crtfc_key': API_KEY,
         'corp_code': corp_code,
         'bgn_de': date_string,
         'end_de': date_string
     }
-    
-    response_bw = requests.get(base_url_bw, params=params)
-    response_cb = requests.get(base_url_cb, params=params)
-    response_eb = requests.get(base_url_eb, params=params)
-    return response_bw.json(), response_cb.json(), response_eb.json()
 
+async def dart_get_async(endpoint_class, fetch, url, params, hedge=False):
+    # Paced by dart_quota's bucket for endpoint_class, retried and circuit-broken by
+    # resilience, and retried again after a '020' (rate limited) backoff.
+    # fetch: client.get_json or client.get_bytes; hedge: duplicate slow attempts
+    for _ in range(RATE_LIMIT_RETRIES + 1):
+        result = await resilience.call_async(endpoint_class, lambda: fetch(url, params=params), hedge=hedge,
+                                             before=lambda: dart_quota.limiter.acquire(endpoint_class))
+        if not dart_quota.is_rate_limited(result):
+            dart_quota.limiter.succeeded()
+            return result
+        await asyncio.sleep(dart_quota.limiter.rate_limited(endpoint_class))
+    # never hand the '020' body on: it would read as an empty list or a broken document
+    raise dart_quota.RateLimited(f"DART rate limit on {endpoint_class} after {RATE_LIMIT_RETRIES} retries")
 
-def run():
+async def get_dart_reports_async(client, start_date, end_date, page_no=1):
+    return await dart_get_async('list', client.get_json, LIST_URL, list_params(start_date, end_date, page_no))
+
+async def get_all_dart_reports_async(client, start_date, end_date, stop_at=None):
+    # Page 1 tells us total_page; the remaining pages are fetched concurrently and
+    # merged in page order. Returns None when DART reports no data.
+    # With stop_at (a watermark rcept_no) pages are read newest-first one at a time
+    # and paging stops at the first page that reaches already-seen filings.
+    first = await get_dart_reports_async(client, start_date, end_date, 1)
+    if first['status'] == '013':
+        return None
+    if first['status'] != '000':
+        # maintenance (800) and the like: fail the run rather than report an empty day
+        raise RuntimeError(f"DART list status {first['status']}: {first.get('message', '')}")
+    total_page = int(first.get('total_page', 1))
+    if stop_at:
+        items = list(first['list'])
+        page, page_no = first, 1
+        while page_no < total_page and page['list'] and min(i['rcept_no'] for i in page['list']) > stop_at:
+            page_no += 1
+            page = await get_dart_reports_async(client, start_date, end_date, page_no)
+            if page['status'] != '000':
+                print(f"Error fetching list page {page_no}: {page.get('status')} {page.get('message', '')}")
+                break
+            items.extend(page['list'])
+        return items
+    rest = await asyncio.gather(*(
+        get_dart_reports_async(client, start_date, end_date, page_no) for page_no in range(2, total_page + 1)),
+        return_exceptions=True)
+    items = list(first['list'])
+    for page_no, data in enumerate(rest, start=2):
+        if isinstance(data, Exception):
+            print(f"Error fetching list page {page_no}: {data!r}")
+            continue
+        if data['status'] != '000':
+            print(f"Error fetching list page {page_no}: {data.get('status')} {data.get('message', '')}")
+            continue
+        items.extend(data['list'])
+    return items
+
+async def get_dart_report_details_async(client, corp_code, date_string, limit):
+    params = detail_params(corp_code, date_string)
+
+    async def fetch(url):
+        async with limit:
+            try:
+                return await dart_get_async('detail', client.get_json, url, params)
+            except Exception as e:
+                print(f"Error fetching {url} for {corp_code}: {e!r}")
+                return {}
+    return tuple(await asyncio.gather(*(fetch(url) for url in DETAIL_URLS)))
+
+async def get_dart_document_async(client, rcept_no):
+    params = {'crtfc_key': API_KEY, 'rcept_no': rcept_no}
+    return await dart_get_async('document', client.get_bytes, DOCUMENT_URL, params, hedge=HEDGE_DOCUMENTS)
+
+def get_report_type(report_nm):
+    if '교환' in report_nm: return 'EB'
+    elif '전환' in report_nm: return 'CB'
+    elif '신주인수권부' in report_nm: return 'BW'
+    return ''
+
+def collect_structured(details):
+    # BW/CB/EB detail responses -> [(type, data)], deduplicated by rcept_no in corp order
+    structured = []
+    texts_codes = set()
+    for responces in details:
+        for bond_type, responce in zip(('BW', 'CB', 'EB'), responces):
+            for data in process_data(responce) or []:
+                if data['rcept_no'] not in texts_codes:
+                    structured.append((bond_type, data))
+                    texts_codes.add(data['rcept_no'])
+    return structured
+
+def format_entry(corp_name, report_type, amount_eok, rcept_no):
+    return f"- {corp_name} {report_type} {amount_eok}억 \n https://dart.fss.or.kr/dsaf001/main.do?rcpNo={rcept_no}"
+
+def structured_amount(data):
+    # bd_fta in 억, or None when the detail API left it blank or non-numeric
+    try:
+        return round(float(data['bd_fta'].replace(',', '')) / 10**8, 1)
+    except (ValueError, AttributeError):
+        return None
+
+
+class RunProgress:
+    # Per-stage status, item counts and timings of one run_async() call.
+    # Written from the run's event loop, read from request threads.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def start(self, stage, total=None):
+        with self._lock:
+            self._stages[stage] = {'status': 'running', 'started_at': time.time(), 'finished_at': None,
+                                   'done': 0, 'total': total}
+
+    def advance(self, stage, n=1):
+        with self._lock:
+            self._stages[stage]['done'] += n
+
+    def finish(self, stage, total=None):
+        with self._lock:
+            info = self._stages[stage]
+            info['status'] = 'done'
+            info['finished_at'] = time.time()
+            if total is not None:
+                info['total'] = info['done'] = total
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for stage, info in self._stages.items():
+                end = info['finished_at'] or time.time()
+                stages[stage] = dict(info, duration=round(end - info['started_at'], 3))
+            return stages
+
+
+async def run_async(progress=None, client=None, incremental=None, mode=None):
+    # client: an open http_client.AsyncClient to reuse (the daemon keeps one warm)
+    # incremental: overrides DART_INCREMENTAL; mode: overrides DART_RUN_MODE
+    progress = progress or RunProgress()
+    if incremental is None:
+        incremental = INCREMENTAL
     # Calculate current time each time function runs
     today = datetime.now(korea_tz)
     today_string = today.strftime('%Y-%m-%d %H:%M') + ' ' + weekday_kr[today.weekday()]
     today_yyyymmdd = today.strftime('%Y%m%d')
 
     info_string = ""
-    # Skip execution on weekends
-    if today.weekday() >= 5:  # 5 is Saturday, 6 is Sunday
+    # Skip execution on weekends and KRX holidays
+    if not krx_calendar.is_disclosure_day(today.date()):
         return None
     current_hour = today.hour
     if current_hour == 1:
@@ -124,125 +313,419 @@ def run():
     #     return None
     # if current_hour == 20:
     #     info_string = "오늘의 마지막 안내입니다.\n"
-    
-    reported_corp_codes = set()
-    reported_rcept_nos = dict()
-    page_no = 1
-    no_data = False
-    while True:
-        data = get_dart_reports(today_yyyymmdd, today_yyyymmdd, page_no)
-        if data['status'] != '000':
-            no_data = True
-            break
-        for item in data['list']:
-            filter_words = ['정정', '감자', '증자', '선택권', '처분', '자기', '자본', '양수도', '소송', '합병', '분할']
-            if any(word in item['report_nm'] for word in filter_words):
+    if (mode or RUN_MODE) == 'alert':
+        return await run_alerts_async(progress, client, incremental, today)
+
+    loop = asyncio.get_running_loop()
+    async with (nullcontext(client) if client else http_client.AsyncClient()) as client:
+        reported_corp_codes = dict()  # ordered set, first-seen order
+        reported_rcept_nos = dict()
+        watermark = load_watermark(today_yyyymmdd) if incremental else None
+        progress.start('list')
+        try:
+            items = await get_all_dart_reports_async(client, today_yyyymmdd, today_yyyymmdd,
+                                                     stop_at=watermark['watermark'] if watermark else None)
+        except Exception as e:
+            # DART down or unreachable after retries (or the breaker is open): give up this run
+            print(f"Error fetching DART list: {e!r}")
+            print(f"DART resilience: {resilience.stats()}")
+            return None
+        progress.finish('list', total=len(items or []))
+        no_data = items is None
+        if watermark is not None:
+            # Filings that failed on an earlier run sit below the watermark; retry them
+            release_parked(watermark)
+            done = watermark['processed'] | set(watermark['parked'])
+            skipped = sum(1 for item in items or [] if item['rcept_no'] in watermark['processed'])
+            new = [item for item in items or [] if item['rcept_no'] not in done
+                   and item['rcept_no'] not in watermark['pending']]
+            items = new + list(watermark['pending'].values())
+            print(f"Incremental: {len(new)} new, {len(watermark['pending'])} retried, {skipped} already processed, "
+                  f"{len(watermark['parked'])} unparseable until their cache entry expires")
+        for item in items or []:
+            if any(word in item['report_nm'] for word in FILTER_WORDS):
+                if watermark is not None:
+                    watermark['processed'].add(item['rcept_no'])
                 continue
-            reported_corp_codes.add(item['corp_code'])
+            reported_corp_codes[item['corp_code']] = None
             reported_rcept_nos[item['rcept_no']] = [item.get('corp_name', ''), item.get('report_nm', '')]
-        if data['total_count'] == 100: page_no += 1
-        else: break
-
-    reported_corp_codes = list(reported_corp_codes)
-    texts = []
-    if not no_data:
-        texts_codes = list()
-        for corp_code in reported_corp_codes:
-            bw_data, cb_data, eb_data = [], [], []
-            responce_bw, responce_cb, responce_eb = get_dart_report_details(corp_code, today_yyyymmdd)
-
-            bw_data = process_data(responce_bw)
-            cb_data = process_data(responce_cb)
-            eb_data = process_data(responce_eb)
-
-            if bw_data:
-                for data in bw_data:
-                    if data['rcept_no'] not in texts_codes:
-                        texts.append(textize(data, 'BW'))
-                        texts_codes.append(data['rcept_no'])
-            if cb_data:
-                for data in cb_data:
-                    if data['rcept_no'] not in texts_codes:
-                        texts.append(textize(data, 'CB'))
-                        texts_codes.append(data['rcept_no'])
-            if eb_data:
-                for data in eb_data:
-                    if data['rcept_no'] not in texts_codes:
-                        texts.append(textize(data, 'EB'))
-                        texts_codes.append(data['rcept_no'])
-    last_texts = load_last_texts()
-
-    source_download_url = "https://opendart.fss.or.kr/api/document.xml"
-    output_entries = []
-    for rcept_no, info in reported_rcept_nos.items():
-        corp_name, report_nm = info[0], info[1]
-        if '교환' in report_nm: report_type = 'EB'
-        elif '전환' in report_nm: report_type = 'CB'
-        elif '신주인수권부' in report_nm: report_type = 'BW'
-        else: report_type = ''
-        url = f"{source_download_url}?crtfc_key={API_KEY}&rcept_no={rcept_no}"
-        response = requests.get(url)
+
+        reported_corp_codes = list(reported_corp_codes)
+        structured_amounts = {}
+        # the detail APIs only feed the fast path; without it the 3 calls per company are wasted quota
+        if STRUCTURED_FAST_PATH and not no_data:
+            detail_limit = asyncio.Semaphore(DETAIL_WORKERS)
+            progress.start('details', total=len(reported_corp_codes))
+
+            async def fetch_details(corp_code):
+                result = await get_dart_report_details_async(client, corp_code, today_yyyymmdd, detail_limit)
+                progress.advance('details')
+                return result
+            details = await asyncio.gather(*(fetch_details(corp_code) for corp_code in reported_corp_codes))
+            progress.finish('details')
+            for _, data in collect_structured(details):
+                amount = structured_amount(data)
+                if amount is not None:
+                    structured_amounts[data['rcept_no']] = amount
+
+        # Each filing is parsed in a worker thread as soon as its download finishes
+        document_limit = asyncio.Semaphore(DOCUMENT_WORKERS)
+
+        cache_stats = {'structured': 0, 'hit': 0, 'negative_hit': 0, 'miss': 0}
+        unparseable = set()
+        cached_entries = {rcept_no: filing_cache.get(rcept_no) for rcept_no in reported_rcept_nos
+                          if rcept_no not in structured_amounts}
+        parse_pool = filing_parser.parse_executor(sum(1 for e in cached_entries.values() if e is None))
+
+        async def fetch_amounts(rcept_no, report_type):
+            if rcept_no in structured_amounts:
+                cache_stats['structured'] += 1
+                return [structured_amounts[rcept_no]]
+            cached = cached_entries[rcept_no]
+            if cached is not None:
+                cache_stats['negative_hit' if cached.get('reason') else 'hit'] += 1
+                if cached.get('reason'):
+                    unparseable.add(rcept_no)
+                return cached['amounts']
+            cache_stats['miss'] += 1
+            try:
+                async with document_limit:
+                    content = await get_dart_document_async(client, rcept_no)
+            except Exception as e:
+                # not cached; the filing is retried on the next run
+                print(f"Error downloading filing {rcept_no}: {e!r}")
+                return []
+            extracted, reason = await loop.run_in_executor(
+                parse_pool, filing_parser.extract_filing, rcept_no, report_type, content)
+            amounts_eok = [amount for _, _, amount in extracted]
+            if amounts_eok:
+                filing_cache.put(rcept_no, report_type, amounts_eok)
+            elif filing_parser.is_transient(reason):
+                # not cached; the filing is retried on the next run
+                print(f"DART did not serve filing {rcept_no}: {reason}")
+            else:
+                print(f"Unparseable filing {rcept_no}: {reason}")
+                filing_cache.put_negative(rcept_no, reason)
+                unparseable.add(rcept_no)
+            return amounts_eok
+
+        async def fetch_amounts_tracked(rcept_no, report_type):
+            result = await fetch_amounts(rcept_no, report_type)
+            progress.advance('documents')
+            return result
+
+        progress.start('documents', total=len(reported_rcept_nos))
+        amounts = await asyncio.gather(*(fetch_amounts_tracked(rcept_no, get_report_type(info[1]))
+                                         for rcept_no, info in reported_rcept_nos.items()))
+        progress.finish('documents')
+        print(f"Filing cache: {cache_stats['structured']} from detail APIs, {cache_stats['hit']} hits, "
+              f"{cache_stats['negative_hit']} negative hits, {cache_stats['miss']} misses")
+        output_entries = []
+        for (rcept_no, info), amounts_eok in zip(reported_rcept_nos.items(), amounts):
+            corp_name, report_nm = info[0], info[1]
+            report_type = get_report_type(report_nm)
+            for amount_eok in amounts_eok:
+                formatted = format_entry(corp_name, report_type, amount_eok, rcept_no)
+                output_entries.append((rcept_no, formatted, report_type, amount_eok, corp_name))
+
         try:
-            with zipfile.ZipFile(BytesIO(response.content)) as zf:
-                file_list = zf.namelist()
-                for name in file_list:
-                    with zf.open(name) as f:
-                        data = f.read()
-                        try:
-                            text = data.decode('utf-8')
-                        except UnicodeDecodeError:
-                            try:
-                                text = data.decode('cp949')
-                            except UnicodeDecodeError:
-                                text = None
-                        if text is not None:
-                            soup = BeautifulSoup(text, 'html.parser')
-                            all_tables = soup.find_all('table')
-                            first_table = next((t for t in all_tables if '권면' in t.get_text()), None)
-                            if first_table is not None:
-                                target_value = None
-                                for tr in first_table.find_all('tr'):
-                                    row_text = tr.get_text(' ', strip=True)
-                                    if '사채의 권면(전자등록)총액' in row_text:
-                                        value_elem = tr.find(lambda tag: tag.name in ['te', 'td', 'th'] and (
-                                            tag.get('acode') == 'DNM_SUM' or tag.get('align', '').upper() == 'RIGHT'))
-                                        if value_elem is None:
-                                            cells = tr.find_all(['te', 'td', 'th'])
-                                            if cells:
-                                                value_elem = cells[-1]
-                                        if value_elem is not None:
-                                            target_value = value_elem.get_text(strip=True)
-                                        break
-                                if target_value is not None:
-                                    try:
-                                        amount_krw = float(str(target_value).replace(',', ''))
-                                        amount_eok = round(amount_krw / (10**8), 1)
-                                        formatted = f"- {corp_name} {report_type} {amount_eok}억 \n https://dart.fss.or.kr/dsaf001/main.do?rcpNo={rcept_no}"
-                                        output_entries.append((rcept_no, formatted))
-                                    except ValueError:
-                                        pass
-                        else:
-                            pass
-        except zipfile.BadZipFile:
-            pass
-    
-    if output_entries:
-        last_rcept_nos = load_last_texts()
-        if not isinstance(last_rcept_nos, list):
-            last_rcept_nos = []
-        new_entries = [(rcp, line) for (rcp, line) in output_entries if rcp not in last_rcept_nos]
-        if new_entries:
+            # kept for bot commands (/today, /corp), which never call DART themselves
+            archived = [(rcept_no, corp_name, report_type, amount_eok)
+                        for rcept_no, _, report_type, amount_eok, corp_name in output_entries]
+            await loop.run_in_executor(None, lambda: filing_archive.get_archive().record(archived))
+        except Exception as e:
+            print(f"Error archiving filings: {e}")
+
+        progress.start('send')
+        acked = 0
+        unacked = set()  # filings some matched chat may still receive; they stay pending
+        if output_entries:
+            # every subscriber gets a digest of the filings its filter matches (CHAT_ID gets all
+            # unless it set filters); a chunk's filings are marked sent once it is delivered
             info_string = today_string + "\n일일 누적 발행내역입니다.\n\n"
-            final_text = info_string + "\n\n".join(line for _, line in new_entries)
-            print(final_text)
-            send_message(final_text)
-            save_last_texts(last_rcept_nos + [rcp for rcp, _ in new_entries])
+
+            def match_chats():
+                # Blocking part (object store / SQLite): subscriber match, sent-state lookup
+                index = subscriptions.get_registry(CHAT_ID).index()
+                by_chat = {}
+                for entry in output_entries:
+                    rcept_no, _, report_type, amount_eok, corp_name = entry
+                    for chat_id in index.match(report_type, corp_name, amount_eok):
+                        by_chat.setdefault(chat_id, []).append(entry)
+                sent = state.get_store().sent((entry[0], chat_id)
+                                              for chat_id, entries in by_chat.items() for entry in entries)
+                return index.size, by_chat, sent
+            subscribers, by_chat, sent = await loop.run_in_executor(None, match_chats)
+            deliveries = []
+            async with telegram_sender.SendQueue(client, BOT_TOKEN) as queue:
+                for chat_id, entries in by_chat.items():
+                    new_entries = [entry for entry in entries if (entry[0], chat_id) not in sent]
+                    for text, chunk in telegram_sender.split_entries(info_string, new_entries, line=lambda entry: entry[1]):
+                        if chat_id == str(CHAT_ID):
+                            print(text)
+                        records = [(rcp, report_type, amount) for rcp, _, report_type, amount, _ in chunk]
+                        deliveries.append((chunk, queue.submit(
+                            chat_id, text, on_ack=lambda chat_id=chat_id, records=records: save_last_texts(records, chat_id))))
+            acked = sum(len(chunk) for chunk, future in deliveries if future.result() == telegram_sender.SENT)
+            # a chat that refused its message for good (bot blocked, chat gone) does not hold the filing back
+            unacked = {entry[0] for chunk, future in deliveries
+                       if future.result() == telegram_sender.UNDELIVERED for entry in chunk}
+            print(f"Broadcast: {len(by_chat)} of {subscribers} subscribers matched, "
+                  f"{len(deliveries)} messages, {acked} filing deliveries")
+        progress.finish('send', total=acked)
+        print(f"Telegram: {telegram_sender.stats()}")
+
+        if watermark is not None:
+            pending_items = {item['rcept_no']: watermark_item(item) for item in items}
+            for rcept_no, amounts_eok in zip(reported_rcept_nos, amounts):
+                if amounts_eok and rcept_no not in unacked:
+                    watermark['processed'].add(rcept_no)
+            watermark['parked'].update((rcp, pending_items[rcp]) for rcp in unparseable)
+            watermark['pending'] = {rcp: item for rcp, item in pending_items.items()
+                                    if rcp not in watermark['processed'] and rcp not in watermark['parked']}
+            watermark['watermark'] = max([watermark['watermark']] + list(pending_items))
+            save_watermark(watermark)
+    dart_quota.limiter.ledger.flush()
+    print(f"HTTP connections: {http_client.connection_stats()}")
+    print(f"DART resilience: {resilience.stats()}")
+    print(f"DART calls today: {dart_quota.limiter.ledger.used()} of {dart_quota.DART_DAILY_LIMIT}")
+    return None
+
+async def run_alerts_async(progress, client, incremental, today):
+    # Streaming pipeline, one stage per task group, bounded queues in between:
+    #   list (newest page first) -> download (DOCUMENT_WORKERS, filing cache first)
+    #   -> extract (worker threads) -> dedup (archive, subscriber match, sent state)
+    #   -> send (one message per filing and chat, marked sent once acknowledged)
+    # A filing is announced as soon as it reaches the end, not when the run finishes.
+    # Stages are drained in order: when one's input queue is empty and its producer is
+    # done, its workers are cancelled and the next queue is joined.
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    today_yyyymmdd = today.strftime('%Y%m%d')
+    watermark = load_watermark(today_yyyymmdd) if incremental else None
+    if watermark is not None:
+        release_parked(watermark)
+    filings_q = asyncio.Queue(ALERT_QUEUE_SIZE)  # list item
+    documents_q = asyncio.Queue(ALERT_QUEUE_SIZE)  # (item, report_type, document bytes)
+    extracted_q = asyncio.Queue(ALERT_QUEUE_SIZE)  # (item, report_type, amounts in 억)
+    alerts_q = asyncio.Queue(ALERT_QUEUE_SIZE)  # (chat_id, text, records)
+    listed = {}  # rcept_no -> list item, for the watermark
+    matched = set()  # filings with amounts whose alerts were all queued
+    unacked = set()  # filings some chat may still receive; they stay pending
+    unparseable = set()  # negatively cached filings, parked until the cache entry expires
+    latencies = []
+    for stage in ('list', 'download', 'extract', 'dedup', 'send'):
+        progress.start(stage)
+
+    async def offer(item):
+        rcept_no = item['rcept_no']
+        if rcept_no in listed or (watermark is not None and (
+                rcept_no in watermark['processed'] or rcept_no in watermark['parked'])):
+            return
+        listed[rcept_no] = item
+        progress.advance('list')
+        if any(word in item['report_nm'] for word in FILTER_WORDS):
+            if watermark is not None:
+                watermark['processed'].add(rcept_no)
+            return
+        await filings_q.put(item)
+
+    async def list_stage():
+        # Pages are read one at a time so page 1's filings are downloading while page 2 loads
+        page_no, total_page = 1, 1
+        try:
+            while page_no <= total_page:
+                page = await get_dart_reports_async(client, today_yyyymmdd, today_yyyymmdd, page_no)
+                if page['status'] != '000':
+                    if page_no > 1 or page['status'] != '013':
+                        print(f"Error fetching list page {page_no}: {page.get('status')} {page.get('message', '')}")
+                    break
+                total_page = int(page.get('total_page', 1))
+                for item in page['list']:
+                    await offer(item)
+                if watermark and page['list'] and min(i['rcept_no'] for i in page['list']) <= watermark['watermark']:
+                    break
+                page_no += 1
+        except Exception as e:
+            print(f"Error fetching DART list: {e!r}")
+        if watermark is not None:
+            # filings that failed on an earlier run
+            for item in list(watermark['pending'].values()):
+                await offer(item)
+
+    async def download_worker():
+        while True:
+            item = await filings_q.get()
+            rcept_no = item['rcept_no']
+            try:
+                report_type = get_report_type(item['report_nm'])
+                cached = filing_cache.get(rcept_no)
+                if cached is not None:
+                    if cached.get('reason'):
+                        unparseable.add(rcept_no)
+                    await extracted_q.put((item, report_type, cached['amounts']))
+                else:
+                    content = await get_dart_document_async(client, rcept_no)
+                    await documents_q.put((item, report_type, content))
+            except Exception as e:
+                print(f"Error downloading filing {rcept_no}: {e!r}")
+            finally:
+                progress.advance('download')
+                filings_q.task_done()
+
+    async def extract_worker():
+        while True:
+            item, report_type, content = await documents_q.get()
+            rcept_no = item['rcept_no']
+            try:
+                # one document at a time parses in milliseconds, so threads rather than the process pool
+                extracted, reason = await loop.run_in_executor(
+                    None, filing_parser.extract_filing, rcept_no, report_type, content)
+                amounts_eok = [amount for _, _, amount in extracted]
+                if amounts_eok:
+                    filing_cache.put(rcept_no, report_type, amounts_eok)
+                elif filing_parser.is_transient(reason):
+                    print(f"DART did not serve filing {rcept_no}: {reason}")
+                else:
+                    print(f"Unparseable filing {rcept_no}: {reason}")
+                    filing_cache.put_negative(rcept_no, reason)
+                    unparseable.add(rcept_no)
+                await extracted_q.put((item, report_type, amounts_eok))
+            except Exception as e:
+                print(f"Error extracting filing {rcept_no}: {e!r}")
+            finally:
+                progress.advance('extract')
+                documents_q.task_done()
+
+    def match_new(item, report_type, amounts_eok):
+        # Blocking part of dedup (object store / SQLite): archive, match, sent-state lookup
+        rcept_no, corp_name = item['rcept_no'], item.get('corp_name', '')
+        filing_archive.get_archive().record([(rcept_no, corp_name, report_type, amount) for amount in amounts_eok])
+        index = subscriptions.get_registry(CHAT_ID).index()
+        alerts = []
+        for amount_eok in amounts_eok:
+            for chat_id in index.match(report_type, corp_name, amount_eok):
+                alerts.append((chat_id, amount_eok))
+        sent = state.get_store().sent({(rcept_no, chat_id) for chat_id, _ in alerts})
+        by_chat = {}
+        for chat_id, amount_eok in alerts:
+            if (rcept_no, chat_id) not in sent:
+                by_chat.setdefault(chat_id, []).append(amount_eok)
+        return by_chat
+
+    async def dedup_stage():
+        while True:
+            item, report_type, amounts_eok = await extracted_q.get()
+            rcept_no = item['rcept_no']
+            try:
+                if amounts_eok:
+                    by_chat = await loop.run_in_executor(None, match_new, item, report_type, amounts_eok)
+                    for chat_id, chat_amounts in by_chat.items():
+                        text = "신규 발행 공시입니다.\n\n" + "\n\n".join(
+                            format_entry(item.get('corp_name', ''), report_type, amount, rcept_no) for amount in chat_amounts)
+                        records = [(rcept_no, report_type, amount) for amount in chat_amounts]
+                        await alerts_q.put((chat_id, text, records))
+                    matched.add(rcept_no)
+            except Exception as e:
+                print(f"Error matching filing {rcept_no}: {e!r}")
+            finally:
+                progress.advance('dedup')
+                extracted_q.task_done()
+
+    async def send_stage(queue):
+        # At most ALERT_QUEUE_SIZE messages wait on Telegram; beyond that the stage stops pulling
+        in_flight = set()
+        while True:
+            chat_id, text, records = await alerts_q.get()
+            try:
+                if chat_id == str(CHAT_ID):
+                    print(text)
+
+                def acked(chat_id=chat_id, records=records):
+                    save_last_texts(records, chat_id)
+                    latencies.append(time.monotonic() - started)
+                    progress.advance('send')
+
+                def resolved(future, rcept_no=records[0][0]):
+                    if future.result() == telegram_sender.UNDELIVERED:
+                        unacked.add(rcept_no)
+                future = queue.submit(chat_id, text, on_ack=acked)
+                future.add_done_callback(resolved)
+                in_flight.add(future)
+                if len(in_flight) >= ALERT_QUEUE_SIZE:
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                alerts_q.task_done()
+
+    async with (nullcontext(client) if client else http_client.AsyncClient()) as client:
+        async with telegram_sender.SendQueue(client, BOT_TOKEN) as queue:
+            stages = [
+                ('download', filings_q, [asyncio.ensure_future(download_worker()) for _ in range(DOCUMENT_WORKERS)]),
+                ('extract', documents_q, [asyncio.ensure_future(extract_worker())
+                                          for _ in range(max(1, filing_parser.PARSE_WORKERS))]),
+                ('dedup', extracted_q, [asyncio.ensure_future(dedup_stage())]),
+                ('send', alerts_q, [asyncio.ensure_future(send_stage(queue))]),
+            ]
+            try:
+                await list_stage()
+                progress.finish('list')
+                for stage, stage_queue, workers in stages:
+                    await stage_queue.join()
+                    for worker in workers:
+                        worker.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+                    if stage != 'send':
+                        progress.finish(stage)
+            finally:
+                for _, _, workers in stages:
+                    for worker in workers:
+                        worker.cancel()
+        # leaving the SendQueue waited for the last messages to be acknowledged
+        progress.finish('send')
+
+        if watermark is not None:
+            # processed once every chat it was sent to acknowledged or permanently refused it
+            watermark['processed'].update(matched - unacked)
+            watermark['parked'].update((rcp, watermark_item(listed[rcp])) for rcp in unparseable)
+            watermark['pending'] = {rcp: watermark_item(item) for rcp, item in listed.items()
+                                    if rcp not in watermark['processed'] and rcp not in watermark['parked']}
+            watermark['watermark'] = max([watermark['watermark']] + list(listed))
+            save_watermark(watermark)
+    if latencies:
+        latencies.sort()
+        print(f"Alerts: {len(latencies)} sent; first after {latencies[0]:.2f}s, "
+              f"median {latencies[len(latencies) // 2]:.2f}s, last {latencies[-1]:.2f}s from run start")
+    else:
+        print(f"Alerts: none sent ({len(listed)} filings listed)")
+    dart_quota.limiter.ledger.flush()
+    print(f"DART resilience: {resilience.stats()}")
+    print(f"Telegram: {telegram_sender.stats()}")
     return None
 
-def send_message(text):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    data = {"chat_id": CHAT_ID, "text": text}
-    requests.post(url, data=data)
+def run():
+    return asyncio.run(run_async())
+
+_single_flight = run_lock.SingleFlight()
+_lease = None
+
+async def _run_with_lease(progress=None, **run_kwargs):
+    global _lease
+    if _lease is None:
+        _lease = run_lock.LeaseLock(run_lock.lease_store())
+    acquired, waited = await _lease.acquire_async()
+    print(f"Run lock wait: {waited:.2f}s ({'acquired' if acquired else 'timed out'})")
+    if not acquired:
+        return {'result': None, 'ran': False, 'lock_wait': round(waited, 3)}
+    result = await _lease.hold_async(run_async(progress, **run_kwargs))
+    return {'result': result, 'ran': True, 'lock_wait': round(waited, 3)}
+
+async def run_coordinated_async(progress=None, **run_kwargs):
+    # Overlapping triggers share one run: in-process via single-flight, across
+    # processes/instances via the run lease. Returns run_async's result plus
+    # whether this call ran it, attached to another run, or timed out on the lease.
+    # progress is only filled in when this call is the one that runs.
+    outcome, shared = await _single_flight.run_async(lambda: _run_with_lease(progress, **run_kwargs))
+    return dict(outcome, shared=shared)
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Client-side limits for OpenDART calls.
+# - A token bucket per endpoint class (list, detail, document) paces every call.
+# - A daily ledger of calls per class is kept in DART_QUOTA_FILE and warns when the
+#   day's usage is projected to run past DART_DAILY_LIMIT.
+# - When DART answers status '020' (request limit exceeded) every bucket pauses,
+#   with the pause doubling on consecutive rate-limit answers.
+
+DART_DAILY_LIMIT = int(os.getenv("DART_DAILY_LIMIT", "20000"))
+DART_QUOTA_WARN_RATIO = float(os.getenv("DART_QUOTA_WARN_RATIO", "0.8"))
+DART_QUOTA_FILE = os.getenv("DART_QUOTA_FILE", "dart_quota.json")
+LEDGER_DAYS = 7
+LEDGER_FLUSH_EVERY = 50
+
+# class: (requests per second, burst); override with e.g. DART_RATE_LIMITS="list=2:4,detail=6:12".
+# The defaults add up to 14/s, under OpenDART's ~1000 calls/minute burst block.
+DEFAULT_RATE_LIMITS = {'list': (2.0, 4), 'detail': (6.0, 12), 'document': (6.0, 12)}
+RATE_LIMITED_STATUS = '020'
+BACKOFF_BASE = float(os.getenv("DART_BACKOFF_BASE", "2"))
+BACKOFF_MAX = float(os.getenv("DART_BACKOFF_MAX", "60"))
+
+korea_tz = timezone(timedelta(hours=9))
+
+
+def _rate_limits():
+    limits = dict(DEFAULT_RATE_LIMITS)
+    for part in os.getenv("DART_RATE_LIMITS", "").split(','):
+        if '=' in part:
+            name, _, spec = part.partition('=')
+            rate, _, burst = spec.partition(':')
+            limits[name.strip()] = (float(rate), int(burst or 1))
+    return limits
+
+
+class TokenBucket:
+    # Thread-safe; a caller reserves a token (the balance may go negative) and then
+    # sleeps for its share of the deficit, so callers on different threads and event
+    # loops (e.g. the webhook worker and a run) share one bucket.
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, not_before=0.0):
+        # Seconds the caller must wait before making its request
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, not_before - now)
+
+
+class QuotaLedger:
+    def __init__(self, path=DART_QUOTA_FILE, daily_limit=DART_DAILY_LIMIT):
+        self.path = path
+        self.daily_limit = daily_limit
+        self._lock = threading.Lock()
+        self._pending = {}  # day -> {class: calls not yet written}
+        self._today = {}  # day -> {class: calls}, including other processes' flushed calls
+        self._unflushed = 0
+        self._warned = set()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Error reading DART quota ledger: {e}")
+            return {}
+
+    def record(self, endpoint_class, n=1):
+        day = datetime.now(korea_tz).strftime('%Y%m%d')
+        with self._lock:
+            if day not in self._today:
+                self._today = {day: self._read().get(day, {})}
+            counts = self._today[day]
+            counts[endpoint_class] = counts.get(endpoint_class, 0) + n
+            pending = self._pending.setdefault(day, {})
+            pending[endpoint_class] = pending.get(endpoint_class, 0) + n
+            self._unflushed += n
+            flush = self._unflushed >= LEDGER_FLUSH_EVERY
+        self._check_projection(day)
+        if flush:
+            self.flush()
+
+    def used(self, day=None):
+        day = day or datetime.now(korea_tz).strftime('%Y%m%d')
+        with self._lock:
+            counts = self._today.get(day, {})
+            return sum(v for k, v in counts.items() if k != 'rate_limited')
+
+    def _check_projection(self, day):
+        used = self.used(day)
+        now = datetime.now(korea_tz)
+        elapsed = (now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+        # extrapolate today's average rate to midnight; ignore the first minutes of the day
+        projected = used * 86400 / elapsed if elapsed > 600 else used
+        for level, reached in (('projected', projected >= self.daily_limit),
+                               ('warn', used >= self.daily_limit * DART_QUOTA_WARN_RATIO)):
+            if reached and (day, level) not in self._warned:
+                self._warned.add((day, level))
+                print(f"DART quota warning ({level}): {used} calls used, {projected:.0f} projected "
+                      f"by end of day, daily limit {self.daily_limit}")
+
+    def flush(self):
+        # Adds this process's unwritten counts to the file (read-modify-write, atomic replace)
+        with self._lock:
+            pending, self._pending, self._unflushed = self._pending, {}, 0
+            if not pending:
+                return
+            try:
+                ledger = self._read()
+                for day, counts in pending.items():
+                    stored = ledger.setdefault(day, {})
+                    for key, n in counts.items():
+                        stored[key] = stored.get(key, 0) + n
+                for day in sorted(ledger)[:-LEDGER_DAYS]:
+                    del ledger[day]
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(ledger, f, indent=2)
+                os.replace(tmp, self.path)
+                for day in self._today:
+                    self._today[day] = dict(ledger.get(day, {}))
+            except Exception as e:
+                print(f"Error saving DART quota ledger: {e}")
+
+
+class DartLimiter:
+    def __init__(self, rate_limits=None, ledger=None):
+        self.buckets = {name: TokenBucket(rate, burst) for name, (rate, burst) in (rate_limits or _rate_limits()).items()}
+        self.ledger = ledger or QuotaLedger()
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._strikes = 0
+
+    def _reserve(self, endpoint_class):
+        bucket = self.buckets.get(endpoint_class)
+        with self._lock:
+            paused_until = self._paused_until
+        wait = bucket.reserve(paused_until) if bucket else max(0.0, paused_until - time.monotonic())
+        self.ledger.record(endpoint_class)
+        return wait
+
+    async def acquire(self, endpoint_class):
+        wait = self._reserve(endpoint_class)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def rate_limited(self, endpoint_class):
+        # DART answered '020': pause all classes; returns the pause in seconds
+        with self._lock:
+            self._strikes += 1
+            pause = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._strikes - 1))
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        self.ledger.record('rate_limited')
+        print(f"DART rate limit hit on {endpoint_class}; pausing {pause:.1f}s")
+        return pause
+
+    def succeeded(self):
+        if self._strikes:
+            with self._lock:
+                self._strikes = 0
+
+
+class RateLimited(Exception):
+    # DART still answered '020' after every rate-limit retry
+    pass
+
+
+def is_rate_limited(response):
+    # JSON responses carry status in the body; document.xml errors come back as XML
+    if isinstance(response, dict):
+        return response.get('status') == RATE_LIMITED_STATUS
+    if isinstance(response, (bytes, bytearray)) and not response.startswith(b'PK'):
+        return b'<status>' + RATE_LIMITED_STATUS.encode() + b'</status>' in response[:512]
+    return False
+
+
+limiter = DartLimiter()
@@ -0,0 +1,117 @@
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import state
+from subscriptions import normalize_corp
+
+# Archive of the filings each run extracted (rcept_no, corp, type, amounts), one
+# JSON object per KST day in the same object store as the subscriptions. It lets
+# bot commands (/today, /corp) be answered without calling DART.
+# Readers cache each day and re-check the current day's generation at most every
+# ARCHIVE_REFRESH seconds; earlier days no longer change once they are cached.
+
+ARCHIVE_DIR = os.getenv("FILING_ARCHIVE_DIR", ".archive")
+ARCHIVE_PREFIX = os.getenv("FILING_ARCHIVE_PREFIX", "dart_bot/archive/")
+ARCHIVE_DAYS = int(os.getenv("FILING_ARCHIVE_DAYS", "30"))
+ARCHIVE_REFRESH = float(os.getenv("FILING_ARCHIVE_REFRESH", "30"))
+
+korea_tz = timezone(timedelta(hours=9))
+
+
+def _today():
+    return datetime.now(korea_tz).strftime('%Y%m%d')
+
+
+class FilingArchive:
+    def __init__(self, store, prefix=ARCHIVE_PREFIX, max_attempts=5):
+        self.store = store
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._days = {}  # day -> (checked_at, generation, {rcept_no: record})
+
+    def _name(self, day):
+        return f"{self.prefix}{day}.json"
+
+    def _load_day(self, day, fresh=False):
+        cached = self._days.get(day)
+        if cached is not None and not fresh:
+            if day < _today() or time.monotonic() - cached[0] < ARCHIVE_REFRESH:
+                return cached
+            if cached[1] == self.store.generation(self._name(day)):
+                self._days[day] = (time.monotonic(), cached[1], cached[2])
+                return self._days[day]
+        data, generation = self.store.read(self._name(day))
+        self._days[day] = (time.monotonic(), generation, json.loads(data) if data else {})
+        return self._days[day]
+
+    def record(self, entries):
+        # entries: [(rcept_no, corp_name, report_type, amount)], one per extracted amount
+        by_day = {}
+        for rcept_no, corp_name, report_type, amount in entries:
+            record = by_day.setdefault(state._day_of(rcept_no), {}).setdefault(
+                rcept_no, {'rcept_no': rcept_no, 'corp_name': corp_name, 'report_type': report_type, 'amounts': []})
+            record['amounts'].append(amount)
+        with self._lock:
+            for day, new_records in by_day.items():
+                for attempt in range(self.max_attempts):
+                    _, generation, records = self._load_day(day, fresh=attempt > 0)
+                    if all(records.get(rcp) == record for rcp, record in new_records.items()):
+                        break
+                    merged = dict(records)
+                    merged.update(new_records)
+                    data = json.dumps(merged, ensure_ascii=False).encode('utf-8')
+                    try:
+                        generation = self.store.write(self._name(day), data, if_generation_match=generation)
+                    except state.StateConflict:
+                        time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+                        continue
+                    self._days[day] = (time.monotonic(), generation, merged)
+                    break
+                else:
+                    raise state.StateConflict(self._name(day))
+
+    def day(self, day=None):
+        # Records of one KST day (default today), oldest first
+        with self._lock:
+            records = self._load_day(day or _today())[2]
+        return [records[rcp] for rcp in sorted(records)]
+
+    def by_corp(self, corp_name, days=ARCHIVE_DAYS):
+        # Records whose corp name contains corp_name over the last days, newest first
+        needle = normalize_corp(corp_name)
+        start = datetime.strptime(_today(), '%Y%m%d')
+        found = []
+        for offset in range(days):
+            day = (start - timedelta(days=offset)).strftime('%Y%m%d')
+            found.extend(record for record in reversed(self.day(day))
+                         if needle and needle in normalize_corp(record['corp_name']))
+        return found
+
+
+def archive_store():
+    if state.STATE_BACKEND == "gcs" and state.STATE_BUCKET:
+        return state.GCSObjectStore(state.STATE_BUCKET)
+    return state.FileObjectStore(ARCHIVE_DIR)
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = FilingArchive(archive_store())
+        return _archive
+
+
+def set_archive(archive):
+    global _archive
+    with _archive_lock:
+        _archive = archive
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# On-disk cache of extraction results per rcept_no. A published filing never
+# changes, so once its amounts are extracted the document is never fetched again.
+# Entries live at <CACHE_DIR>/<sha1[:2]>/<sha1>.json and the oldest-used ones are
+# evicted when the directory grows past MAX_BYTES.
+# Filings that could not be parsed get a negative entry with a reason code; it
+# expires after NEGATIVE_TTL seconds so a document DART fixes later is retried.
+
+CACHE_DIR = os.getenv("FILING_CACHE_DIR", ".filing_cache")
+MAX_BYTES = int(os.getenv("FILING_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+NEGATIVE_TTL = int(os.getenv("FILING_NEGATIVE_TTL", "3600"))
+
+_lock = threading.Lock()
+_size = None  # bytes on disk, computed lazily
+
+
+def _path(rcept_no):
+    digest = hashlib.sha1(rcept_no.encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, digest[:2], digest + ".json")
+
+
+def _entries():
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.endswith(".json"):
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+
+def _disk_size():
+    global _size
+    if _size is None:
+        _size = sum(size for _, size, _ in _entries())
+    return _size
+
+
+def get(rcept_no):
+    # Positive entry, unexpired negative entry (has 'reason'), or None
+    path = _path(rcept_no)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if entry.get("reason") and time.time() - entry.get("stored_at", 0) > NEGATIVE_TTL:
+            return None
+        os.utime(path)  # mark as recently used for eviction
+        return entry
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error reading filing cache for {rcept_no}: {e}")
+        return None
+
+
+def put(rcept_no, report_type, amounts):
+    _write(rcept_no, {"rcept_no": rcept_no, "report_type": report_type, "amounts": amounts,
+                      "stored_at": int(time.time())})
+
+
+def put_negative(rcept_no, reason):
+    _write(rcept_no, {"rcept_no": rcept_no, "reason": reason, "amounts": [], "stored_at": int(time.time())})
+
+
+def _write(rcept_no, entry):
+    global _size
+    path = _path(rcept_no)
+    data = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        with _lock:
+            size = _disk_size()
+            old = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+            _size = size - old + len(data)
+            if _size > MAX_BYTES:
+                _evict()
+    except Exception as e:
+        print(f"Error writing filing cache for {rcept_no}: {e}")
+
+
+def _evict():
+    # Drop least recently used entries until the cache is back under 90% of MAX_BYTES
+    global _size
+    target = MAX_BYTES * 0.9
+    for path, size, _ in sorted(_entries(), key=lambda e: e[2]):
+        if _size <= target:
+            break
+        try:
+            os.remove(path)
+            _size -= size
+        except OSError:
+            pass
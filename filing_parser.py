@@ -0,0 +1,215 @@
+import codecs
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from io import BytesIO
+
+# Extraction of the '사채의 권면(전자등록)총액' amount from a DART document.xml zip.
+# Kept free of bot configuration so it can be imported cheaply by worker processes.
+
+TABLE_MARKER = '권면'
+ROW_LABEL = '사채의 권면(전자등록)총액'
+CELL_TAGS = ('te', 'td', 'th')
+
+# '권면' as raw bytes in each encoding a filing may use; members without it are never decoded
+AMOUNT_MARKERS = (TABLE_MARKER.encode('utf-8'), TABLE_MARKER.encode('cp949'))
+
+# DART answers a failed document.xml request with an XML status body instead of a zip.
+# 013/014 mean there is no document for the filing; other statuses (020 quota, 800
+# maintenance, 900 ...) are transient and must not be negatively cached.
+DART_STATUS = re.compile(rb'<status>\s*(\d+)\s*</status>')
+PERMANENT_STATUSES = ('013', '014')
+
+# Decoded text is fed to the parser in chunks so it can stop before the end of the document
+CHUNK_SIZE = 64 * 1024
+
+# Process pool for CPU-bound extraction; batches smaller than PARSE_POOL_MIN_BATCH
+# are parsed in-process so pool startup is only paid when it can pay off.
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARSE_POOL_MIN_BATCH = int(os.getenv("PARSE_POOL_MIN_BATCH", "8"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class AmountRowParser(HTMLParser):
+    # Streams a filing and stops at the first ROW_LABEL row of the first table
+    # mentioning '권면'. Only the open rows and their cell texts are kept, no tree.
+    # handle_data may get one text node in several pieces (feed boundaries), so a
+    # node is buffered raw and only stripped once the next tag ends it.
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done = False
+        self.value = None
+        self._table_depth = 0
+        self._table_has_marker = False
+        self._tail = ''
+        self._rows = []  # open rows: {'text': [...], 'cells': [...], 'open': [...]}
+        self._data = []  # raw pieces of the current text node
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        self._flush()
+        if tag == 'table':
+            self._table_depth += 1
+        elif tag == 'tr' and self._table_depth:
+            self._rows.append({'text': [], 'cells': [], 'open': []})
+        elif tag in CELL_TAGS and self._rows:
+            attrs = dict(attrs)
+            preferred = attrs.get('acode') == 'DNM_SUM' or (attrs.get('align') or '').upper() == 'RIGHT'
+            cell = {'text': [], 'preferred': preferred}
+            self._rows[-1]['cells'].append(cell)
+            self._rows[-1]['open'].append(cell)
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        self._flush()
+        if tag in CELL_TAGS and self._rows and self._rows[-1]['open']:
+            self._rows[-1]['open'].pop()
+        elif tag == 'tr' and self._rows:
+            row = self._rows.pop()
+            if ROW_LABEL in ' '.join(' '.join(row['text']).split()):
+                self._finish(row)
+        elif tag == 'table' and self._table_depth:
+            self._table_depth -= 1
+            if self._table_depth == 0:
+                if self._table_has_marker:
+                    # The first '권면' table has no amount row
+                    self.done = True
+                self._table_has_marker = False
+                self._tail = ''
+                self._rows = []
+
+    def handle_data(self, data):
+        if self.done or not self._table_depth:
+            return
+        if TABLE_MARKER in self._tail + data:
+            self._table_has_marker = True
+        self._tail = data[-1:] or self._tail
+        if self._rows:
+            self._data.append(data)
+
+    def _flush(self):
+        piece = ''.join(self._data).strip()
+        self._data = []
+        if not piece:
+            return
+        for row in self._rows:
+            row['text'].append(piece)
+            for cell in row['open']:
+                cell['text'].append(piece)
+
+    def _finish(self, row):
+        cell = next((c for c in row['cells'] if c['preferred']), None)
+        if cell is None and row['cells']:
+            cell = row['cells'][-1]
+        if cell is not None:
+            self.value = ''.join(cell['text'])
+        self.done = True
+
+
+def _feed(parser, chunks):
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.done:
+            return parser.value
+    parser.close()
+    return parser.value
+
+
+def extract_bond_amount(text):
+    # Value of '사채의 권면(전자등록)총액' in the first table mentioning '권면', or None
+    return _feed(AmountRowParser(), (text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)))
+
+
+def extract_bond_amount_bytes(data, encoding):
+    # Same as extract_bond_amount, decoding incrementally; raises UnicodeDecodeError
+    decoder = codecs.getincrementaldecoder(encoding)()
+
+    def chunks():
+        for i in range(0, len(data), CHUNK_SIZE):
+            yield decoder.decode(data[i:i + CHUNK_SIZE])
+        yield decoder.decode(b'', final=True)
+    return _feed(AmountRowParser(), chunks())
+
+
+def parse_document(content):
+    # (amounts in 억, one per matching member; reason code when nothing was extracted)
+    # Reasons: 'bad_zip', 'no_table', 'decode' (marker found but undecodable), 'bad_value',
+    # 'dart_<status>' (DART returned a status body instead of the document)
+    amounts = []
+    matched = False
+    decoded = False
+    bad_value = False
+    try:
+        with zipfile.ZipFile(BytesIO(content)) as zf:
+            for name in zf.namelist():
+                with zf.open(name) as f:
+                    data = f.read()
+                if not any(marker in data for marker in AMOUNT_MARKERS):
+                    continue
+                matched = True
+                try:
+                    target_value = extract_bond_amount_bytes(data, 'utf-8')
+                except UnicodeDecodeError:
+                    try:
+                        target_value = extract_bond_amount_bytes(data, 'cp949')
+                    except UnicodeDecodeError:
+                        continue
+                decoded = True
+                if target_value is not None:
+                    try:
+                        amount_krw = float(str(target_value).replace(',', ''))
+                        amounts.append(round(amount_krw / (10**8), 1))
+                    except ValueError:
+                        bad_value = True
+    except zipfile.BadZipFile:
+        status = DART_STATUS.search(content[:512])
+        if status:
+            return amounts, 'dart_' + status.group(1).decode()
+        return amounts, 'bad_zip'
+    if amounts:
+        return amounts, None
+    if not matched:
+        return amounts, 'no_table'
+    if not decoded:
+        return amounts, 'decode'
+    return amounts, 'bad_value' if bad_value else 'no_table'
+
+
+def is_transient(reason):
+    # A DART status answer worth retrying on the next run rather than caching
+    return bool(reason) and reason.startswith('dart_') and reason[5:] not in PERMANENT_STATUSES
+
+
+def extract_filing(rcept_no, report_type, content):
+    # Raw zip bytes -> ([(rcept_no, report_type, amount), ...], reason); runs in pool workers
+    amounts, reason = parse_document(content)
+    return [(rcept_no, report_type, amount) for amount in amounts], reason
+
+
+def parse_executor(batch_size):
+    # Process pool for a batch of batch_size documents, or None to parse in-process
+    global _pool
+    if PARSE_WORKERS <= 1 or batch_size < PARSE_POOL_MIN_BATCH:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the bot process runs event-loop and HTTP threads that must not be forked
+            _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import threading
+from contextlib import nullcontext
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# Keep-alive HTTP client for every DART / Telegram call.
+# One AsyncClient per run (the daemon keeps one open across runs), so TCP+TLS
+# connections are reused; connection_stats() counts requests and new connections.
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# Whole-request cap for AsyncClient, so a server trickling bytes cannot hold a request open
+TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "60"))
+
+DART_HOST = "opendart.fss.or.kr"
+TELEGRAM_HOST = "api.telegram.org"
+
+# Max keep-alive connections per host; also a hard cap on in-flight requests to
+# that host, since requests wait on the host's semaphore instead of opening more.
+HOST_POOL_SIZES = {
+    DART_HOST: int(os.getenv("DART_POOL_SIZE", "16")),
+    TELEGRAM_HOST: int(os.getenv("TELEGRAM_POOL_SIZE", "4")),
+}
+
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "new_connections": 0}
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def connection_stats():
+    with _stats_lock:
+        total = _stats["requests"]
+        new = _stats["new_connections"]
+    reused = max(total - new, 0)
+    ratio = round(reused / total, 3) if total else 0.0
+    return {"requests": total, "new_connections": new, "reused_connections": reused, "reuse_ratio": ratio}
+
+
+async def _on_request_start(session, ctx, params):
+    _count("requests")
+
+
+async def _on_connection_create_end(session, ctx, params):
+    _count("new_connections")
+
+
+class AsyncClient:
+    # aiohttp session used by dart_bot.run_async() and the webhook.
+    # Each upstream host gets a semaphore of its HOST_POOL_SIZES size.
+
+    def __init__(self):
+        self.session = None
+        self._semaphores = {}
+
+    async def __aenter__(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(_on_request_start)
+        trace.on_connection_create_end.append(_on_connection_create_end)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=max(HOST_POOL_SIZES.values())),
+            timeout=aiohttp.ClientTimeout(total=TOTAL_TIMEOUT, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+            headers={"Accept-Encoding": "gzip, deflate"},
+            trace_configs=[trace],
+        )
+        self._semaphores = {host: asyncio.Semaphore(size) for host, size in HOST_POOL_SIZES.items()}
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def _limit(self, url):
+        return self._semaphores.get(urlsplit(url).hostname) or nullcontext()
+
+    async def get_json(self, url, params=None):
+        async with self._limit(url):
+            async with self.session.get(url, params=_str_params(params)) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+
+    async def get_bytes(self, url, params=None):
+        async with self._limit(url):
+            async with self.session.get(url, params=_str_params(params)) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def post(self, url, data=None):
+        async with self._limit(url):
+            async with self.session.post(url, data=data) as response:
+                return await response.read()
+
+
+def _str_params(params):
+    # aiohttp only accepts str/int/float query values
+    return {k: str(v) for k, v in params.items()} if params else None
+
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+import dart_bot
+
+# Background runs for the POST /runs job API in app.py. Jobs execute one at a
+# time on a worker thread with its own event loop; a trigger that arrives while a
+# job is queued or running gets that job back instead of a new one.
+# The run continues after the 202 response, so on Cloud Run the service needs
+# "CPU always allocated" (--no-cpu-throttling); with request-based allocation the
+# worker is throttled to almost nothing between requests.
+
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "50"))
+
+_lock = threading.Lock()
+_jobs = OrderedDict()  # job id -> Job, oldest first
+_queue = queue.Queue()
+_worker = None
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = dart_bot.RunProgress()
+        self.outcome = None
+        self.error = None
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'queue_wait': round((self.started_at or end) - self.created_at, 3),
+            'duration': round(end - self.started_at, 3) if self.started_at else None,
+            'stages': self.progress.snapshot(),
+            'outcome': self.outcome,
+            'error': self.error,
+        }
+
+
+def submit():
+    # (job, created) - created is False when an active job was returned instead
+    global _worker
+    with _lock:
+        active = next((job for job in _jobs.values() if job.status in ('queued', 'running')), None)
+        if active is not None:
+            return active, False
+        job = Job()
+        _jobs[job.id] = job
+        while len(_jobs) > JOB_HISTORY:
+            _jobs.popitem(last=False)
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name="dart-bot-jobs", daemon=True)
+            _worker.start()
+    _queue.put(job)
+    return job, True
+
+
+def get(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def _work():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    while True:
+        job = _queue.get()
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.outcome = loop.run_until_complete(dart_bot.run_coordinated_async(job.progress))
+            job.status = 'succeeded'
+        except Exception as e:
+            traceback.print_exc()
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = 'failed'
+        job.finished_at = time.time()
@@ -0,0 +1,68 @@
+import os
+from datetime import date, timedelta
+
+# KRX trading calendar used to skip days with no DART filings.
+# One lookup table per year of weekday market holidays (MMDD); extend it each
+# year from the KRX holiday notice. Years missing from the table fall back to
+# skipping weekends only.
+
+KRX_HOLIDAYS = {
+    2025: ('0101', '0127', '0128', '0129', '0130', '0303', '0501', '0505', '0506', '0603', '0606',
+           '0815', '1003', '1006', '1007', '1008', '1009', '1225', '1231'),
+    2026: ('0101', '0216', '0217', '0218', '0302', '0501', '0505', '0525', '0603', '0817',
+           '0924', '0925', '1005', '1009', '1225', '1231'),
+    2027: ('0101', '0208', '0209', '0301', '0505', '0513', '0816', '0914', '0915', '0916',
+           '1004', '1011', '1227', '1231'),
+}
+
+# The market is closed but DART still accepts filings (Labor Day, year-end closing)
+DISCLOSURE_WHEN_CLOSED = ('0501', '1231')
+
+# Overrides, comma-separated YYYYMMDD: extra days to treat as disclosure days or as holidays
+EXTRA_DISCLOSURE_DAYS = os.getenv("DART_EXTRA_DISCLOSURE_DAYS", "")
+EXTRA_HOLIDAYS = os.getenv("DART_EXTRA_HOLIDAYS", "")
+
+
+def _parse_days(value):
+    return frozenset(date(int(d[:4]), int(d[4:6]), int(d[6:8])) for d in value.replace(' ', '').split(',') if d)
+
+
+_holidays = {
+    year: frozenset(date(year, int(mmdd[:2]), int(mmdd[2:])) for mmdd in days)
+    for year, days in KRX_HOLIDAYS.items()
+}
+_extra_disclosure = _parse_days(EXTRA_DISCLOSURE_DAYS)
+_extra_holidays = _parse_days(EXTRA_HOLIDAYS)
+_warned_years = set()
+
+
+def is_krx_holiday(day):
+    # Weekday on which the market is closed
+    if day in _extra_holidays:
+        return True
+    holidays = _holidays.get(day.year)
+    if holidays is None:
+        if day.year not in _warned_years:
+            _warned_years.add(day.year)
+            print(f"No KRX holiday table for {day.year}; only weekends are skipped")
+        return False
+    return day in holidays
+
+
+def is_disclosure_day(day):
+    # Whether DART filings can be expected on this (KST) date
+    if day in _extra_disclosure:
+        return True
+    if day.weekday() >= 5:
+        return False
+    if not is_krx_holiday(day):
+        return True
+    return day.strftime('%m%d') in DISCLOSURE_WHEN_CLOSED and day not in _extra_holidays
+
+
+def next_disclosure_day(day):
+    # First disclosure day strictly after day
+    day += timedelta(days=1)
+    while not is_disclosure_day(day):
+        day += timedelta(days=1)
+    return day
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# Retry, hedging and circuit breaking for DART calls (used by dart_bot.dart_get_async).
+# - Failed attempts (connection errors, timeouts, non-JSON error pages) are retried
+#   per endpoint class with full-jitter exponential backoff.
+# - Hedged downloads: if an attempt is still running after the recent p95 latency,
+#   a duplicate request is started and whichever finishes first is used.
+# - A circuit breaker on the DART host opens after BREAKER_THRESHOLD consecutive
+#   failures; calls then fail immediately with CircuitOpen until BREAKER_COOLDOWN
+#   has passed and a single probe call succeeds.
+
+# class: attempts including the first; override with e.g. DART_RETRIES="list=4,document=3"
+DEFAULT_RETRIES = {'list': 4, 'detail': 3, 'document': 3}
+RETRY_BASE = float(os.getenv("DART_RETRY_BASE", "0.5"))
+RETRY_MAX = float(os.getenv("DART_RETRY_MAX", "8"))
+
+HEDGE_MIN_DELAY = float(os.getenv("DART_HEDGE_MIN_DELAY", "1"))
+HEDGE_SAMPLES = 200
+
+BREAKER_THRESHOLD = int(os.getenv("DART_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("DART_BREAKER_COOLDOWN", "30"))
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def _retries():
+    retries = dict(DEFAULT_RETRIES)
+    for part in os.getenv("DART_RETRIES", "").split(','):
+        if '=' in part:
+            name, _, attempts = part.partition('=')
+            retries[name.strip()] = max(1, int(attempts))
+    return retries
+
+
+_stats_lock = threading.Lock()
+_stats = {"retries": 0, "retry_recoveries": 0, "retry_failures": 0, "hedges": 0, "hedge_wins": 0,
+          "breaker_opens": 0, "breaker_rejections": 0}
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result["p95_seconds"] = {name: round(p95, 3) for name in DEFAULT_RETRIES
+                             if (p95 := latencies.p95(name)) is not None}
+    result["breaker_state"] = breaker.state
+    return result
+
+
+class CircuitBreaker:
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'half-open' if time.monotonic() - self._opened_at >= self.cooldown else 'open'
+
+    def before_call(self):
+        # Raises CircuitOpen unless the call may go ahead; returns True for the half-open probe
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at >= self.cooldown and not self._probing:
+                self._probing = True
+                return True
+        _count("breaker_rejections")
+        raise CircuitOpen("DART circuit breaker is open")
+
+    def abandon_probe(self):
+        # The probe was cancelled (e.g. it lost a hedge race) before it had a result
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok, probe=False):
+        with self._lock:
+            if probe:
+                self._probing = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if probe or (self._opened_at is None and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            _count("breaker_opens")
+            print(f"DART circuit breaker opened after {self._failures} consecutive failures")
+
+
+class LatencyTracker:
+    # Recent successful-attempt latencies per endpoint class, for the hedge delay
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def add(self, endpoint_class, seconds):
+        with self._lock:
+            self._samples.setdefault(endpoint_class, deque(maxlen=HEDGE_SAMPLES)).append(seconds)
+
+    def p95(self, endpoint_class):
+        with self._lock:
+            samples = sorted(self._samples.get(endpoint_class, ()))
+        if len(samples) < 20:
+            return None
+        return samples[int(len(samples) * 0.95) - 1]
+
+    def hedge_delay(self, endpoint_class):
+        return max(HEDGE_MIN_DELAY, self.p95(endpoint_class) or HEDGE_MIN_DELAY * 2)
+
+
+retries = _retries()
+breaker = CircuitBreaker()
+latencies = LatencyTracker()
+
+
+def _backoff(attempt):
+    return random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+
+
+def _attempts(endpoint_class):
+    return retries.get(endpoint_class, 1)
+
+
+def _finish_call(attempt, error):
+    if error is None:
+        if attempt:
+            _count("retry_recoveries")
+        return
+    _count("retry_failures")
+    raise error
+
+
+async def _timed(endpoint_class, coro_fn, before, sent=None):
+    # sent: optional asyncio.Event set once before() is done and the request goes out
+    probe = breaker.before_call()
+    try:
+        if before:
+            await before()
+        if sent:
+            sent.set()
+        started = time.monotonic()
+        result = await coro_fn()
+    except asyncio.CancelledError:
+        if probe:
+            breaker.abandon_probe()
+        raise
+    except Exception:
+        breaker.record(False, probe)
+        raise
+    breaker.record(True, probe)
+    latencies.add(endpoint_class, time.monotonic() - started)
+    return result
+
+
+async def _hedged(endpoint_class, coro_fn, before):
+    # First attempt; a duplicate starts if it is still running hedge_delay after it was sent
+    sent = asyncio.Event()
+    primary = asyncio.ensure_future(_timed(endpoint_class, coro_fn, before, sent))
+    pending = {primary}
+    try:
+        waiter = asyncio.ensure_future(sent.wait())
+        await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        done, _ = await asyncio.wait({primary}, timeout=latencies.hedge_delay(endpoint_class))
+        if done:
+            return primary.result()
+        _count("hedges")
+        hedge = asyncio.ensure_future(_timed(endpoint_class, coro_fn, before))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _count("hedge_wins")
+                    return task.result()
+        # both failed; prefer the primary's error unless it was just the open breaker
+        return hedge.result() if isinstance(primary.exception(), CircuitOpen) else primary.result()
+    finally:
+        pending = [task for task in pending if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def call_async(endpoint_class, coro_fn, hedge=False, before=None):
+    # coro_fn() with retries behind the breaker; before() (e.g. rate limiting) runs ahead
+    # of each attempt and is not counted in its latency. hedge=True duplicates attempts
+    # slower than the recent p95
+    error = None
+    for attempt in range(_attempts(endpoint_class)):
+        if attempt:
+            _count("retries")
+            await asyncio.sleep(_backoff(attempt - 1))
+        try:
+            if hedge:
+                result = await _hedged(endpoint_class, coro_fn, before)
+            else:
+                result = await _timed(endpoint_class, coro_fn, before)
+        except CircuitOpen as e:
+            error = e
+            break
+        except Exception as e:
+            error = e
+            continue
+        _finish_call(attempt, None)
+        return result
+    _finish_call(attempt, error)
@@ -0,0 +1,121 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+import state
+
+# Coordination of dart_bot runs triggered through app.py.
+# SingleFlight: concurrent triggers in one process attach to the run in progress.
+# LeaseLock: a lease in the object store (Cloud Storage with STATE_BACKEND=gcs,
+# otherwise a local directory) so only one process or instance runs at a time.
+# The holder renews the lease while running; a crashed holder's lease expires.
+
+RUN_LOCK_TTL = float(os.getenv("RUN_LOCK_TTL", "300"))
+RUN_LOCK_WAIT = float(os.getenv("RUN_LOCK_WAIT", "120"))
+RUN_LOCK_POLL = float(os.getenv("RUN_LOCK_POLL", "1"))
+RUN_LOCK_DIR = os.getenv("RUN_LOCK_DIR", ".run_lock")
+RUN_LOCK_NAME = os.getenv("RUN_LOCK_NAME", "dart_bot/run.lock")
+
+
+class SingleFlight:
+    # Works across event loops: Flask runs each async view on its own loop thread
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._future = None
+
+    async def run_async(self, coro_fn):
+        # (result, shared) where shared is True when we attached to another caller's run
+        with self._lock:
+            future = self._future
+            leader = future is None
+            if leader:
+                future = self._future = concurrent.futures.Future()
+        if not leader:
+            return await asyncio.wrap_future(future), True
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            with self._lock:
+                self._future = None
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._future = None
+        future.set_result(result)
+        return result, False
+
+
+class LeaseLock:
+    def __init__(self, store, name=RUN_LOCK_NAME, ttl=RUN_LOCK_TTL):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._generation = None
+
+    def try_acquire(self):
+        data, generation = self.store.read(self.name)
+        if data:
+            lease = json.loads(data)
+            if lease.get('expires', 0) > time.time() and lease.get('owner') != self.owner:
+                return False
+        return self._write(time.time() + self.ttl, generation)
+
+    def renew(self):
+        if self._generation is None or not self._write(time.time() + self.ttl, self._generation):
+            print(f"Lost run lease {self.name}")
+            return False
+        return True
+
+    def release(self):
+        if self._generation is not None:
+            self._write(0, self._generation)
+            self._generation = None
+
+    def _write(self, expires, generation):
+        data = json.dumps({'owner': self.owner, 'expires': expires}).encode('utf-8')
+        try:
+            self._generation = self.store.write(self.name, data, if_generation_match=generation)
+            return True
+        except state.StateConflict:
+            self._generation = None
+            return False
+
+    async def acquire_async(self, timeout=RUN_LOCK_WAIT):
+        # (acquired, seconds waited)
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        while True:
+            if await loop.run_in_executor(None, self.try_acquire):
+                return True, time.monotonic() - start
+            if time.monotonic() - start >= timeout:
+                return False, time.monotonic() - start
+            await asyncio.sleep(RUN_LOCK_POLL)
+
+    async def hold_async(self, coro):
+        # Run coro while renewing the lease every ttl/3
+        loop = asyncio.get_running_loop()
+
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(self.ttl / 3)
+                await loop.run_in_executor(None, self.renew)
+
+        task = asyncio.create_task(heartbeat())
+        try:
+            return await coro
+        finally:
+            task.cancel()
+            await loop.run_in_executor(None, self.release)
+
+
+def lease_store():
+    if state.STATE_BACKEND == "gcs" and state.STATE_BUCKET:
+        return state.GCSObjectStore(state.STATE_BUCKET)
+    return state.FileObjectStore(RUN_LOCK_DIR)
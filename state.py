@@ -0,0 +1,528 @@
+import fcntl
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+# Record of filings already sent to each Telegram chat, keyed by (rcept_no, chat_id),
+# behind the StateBackend interface (sent / is_sent / mark_sent). The backend is
+# selected with STATE_BACKEND:
+#   sqlite - SQLite in WAL mode, primary key (rcept_no, chat_id) (default)
+#   file   - append-only log with one file per KST day
+#   gcs    - one JSON object per day in a Cloud Storage bucket, shared by all
+#            instances and written with generation-matched (conditional) uploads
+#   memory - the object-storage backend over an in-process fake, for tests
+# An existing last_texts.json is imported once by the sqlite and file backends.
+# Records from before sent state was per chat (a plain rcept_no, or the
+# "rcept_no:chat_id" keys of the first subscriber release) are read as the same
+# pairs, with DEFAULT_CHAT_ID for those without a chat.
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB = os.getenv("STATE_DB", "state.db")
+SENT_LOG_DIR = os.getenv("SENT_LOG_DIR", "sent_log")
+SENT_LOG_RETENTION_DAYS = int(os.getenv("SENT_LOG_RETENTION_DAYS", "7"))
+STATE_BUCKET = os.getenv("STATE_BUCKET")
+STATE_PREFIX = os.getenv("STATE_PREFIX", "dart_bot/sent/")
+LEGACY_JSON_FILE = "last_texts.json"
+DEFAULT_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+if not DEFAULT_CHAT_ID:
+    # the same fallback dart_bot uses for CHAT_ID
+    try:
+        from configs import CHAT_ID as DEFAULT_CHAT_ID
+    except ImportError:
+        DEFAULT_CHAT_ID = ''
+DEFAULT_CHAT_ID = str(DEFAULT_CHAT_ID or '')
+
+korea_tz = timezone(timedelta(hours=9))
+
+# SQLite's default limit on bound parameters is 999
+_IN_CHUNK = 500
+
+
+class StateConflict(Exception):
+    # A conditional write lost the race against another instance
+    pass
+
+
+def _chat(chat_id):
+    return str(chat_id) if chat_id else DEFAULT_CHAT_ID
+
+
+def _split_key(key, chat_id=None):
+    # (rcept_no, chat_id) of a stored record, including the older key formats
+    rcept_no, _, packed = key.partition(':')
+    return rcept_no, _chat(packed or chat_id)
+
+
+class StateBackend:
+    # Interface behind dart_bot.save_last_texts and the sent-state lookups
+
+    def sent(self, keys):
+        # Subset of keys, (rcept_no, chat_id) pairs, that were already sent
+        raise NotImplementedError
+
+    def is_sent(self, rcept_no, chat_id=None):
+        return bool(self.sent([(rcept_no, _chat(chat_id))]))
+
+    def mark_sent(self, entries, chat_id=None):
+        # entries: [(rcept_no, report_type, amount)] sent to chat_id (default DEFAULT_CHAT_ID)
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteStateStore(StateBackend):
+    _SCHEMA = ("CREATE TABLE IF NOT EXISTS sent ("
+               " rcept_no TEXT NOT NULL,"
+               " chat_id TEXT NOT NULL,"
+               " sent_at INTEGER,"
+               " report_type TEXT,"
+               " amount REAL,"
+               " PRIMARY KEY (rcept_no, chat_id))")
+
+    def __init__(self, path=STATE_DB, legacy_json=LEGACY_JSON_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self.migrate_chat_key()
+        self._conn.execute(self._SCHEMA)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_json:
+            self.migrate_json(legacy_json)
+
+    def migrate_chat_key(self):
+        # One-time rebuild of the rcept_no-keyed table of earlier versions
+        columns = self._conn.execute("PRAGMA table_info(sent)").fetchall()
+        if [column[1] for column in columns if column[5]] != ['rcept_no']:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                rows = self._conn.execute(
+                    "SELECT rcept_no, sent_at, chat_id, report_type, amount FROM sent").fetchall()
+                self._conn.execute("DROP TABLE sent")
+                self._conn.execute(self._SCHEMA)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sent (rcept_no, chat_id, sent_at, report_type, amount) VALUES (?, ?, ?, ?, ?)",
+                    [_split_key(key, chat_id) + (sent_at, report_type, amount)
+                     for key, sent_at, chat_id, report_type, amount in rows])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        print(f"Migrated {len(rows)} sent records in {self.path} to (rcept_no, chat_id) keys")
+        return len(rows)
+
+    def migrate_json(self, path):
+        # One-time import of the old last_texts.json rcept_no list
+        with self._lock:
+            done = self._conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone()
+        if done or not os.path.exists(path):
+            return 0
+        rows = [(rcp, DEFAULT_CHAT_ID, None, None, None) for rcp in _read_legacy_json(path)]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO sent (rcept_no, chat_id, sent_at, report_type, amount) VALUES (?, ?, ?, ?, ?)",
+                    rows)
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)", (path,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        print(f"Migrated {len(rows)} rcept_nos from {path} to {self.path}")
+        return len(rows)
+
+    def sent(self, keys):
+        # Subset of (rcept_no, chat_id) keys that were already sent; looked up by rcept_no,
+        # the leading primary key column, and narrowed to the asked chats here
+        wanted = {(rcept_no, _chat(chat_id)) for rcept_no, chat_id in keys}
+        rcept_nos = sorted({rcept_no for rcept_no, _ in wanted})
+        found = set()
+        with self._lock:
+            for i in range(0, len(rcept_nos), _IN_CHUNK):
+                chunk = rcept_nos[i:i + _IN_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT rcept_no, chat_id FROM sent WHERE rcept_no IN ({placeholders})", chunk)
+                found.update(key for key in map(tuple, rows) if key in wanted)
+        return found
+
+    def is_sent(self, rcept_no, chat_id=None):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM sent WHERE rcept_no = ? AND chat_id = ?",
+                                      (rcept_no, _chat(chat_id))).fetchone() is not None
+
+    def mark_sent(self, entries, chat_id=None):
+        # entries: [(rcept_no, report_type, amount)], inserted in a single transaction
+        now = int(time.time())
+        rows = [(rcept_no, _chat(chat_id), now, report_type, amount) for rcept_no, report_type, amount in entries]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sent (rcept_no, chat_id, sent_at, report_type, amount) VALUES (?, ?, ?, ?, ?)",
+                    rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class FileSentLog(StateBackend):
+    # Append-only sent log, one file per KST day named after the rcept_no date prefix.
+    # <day>.log is appended to while the day is current; once the day has passed it
+    # is compacted into <day>.sent (unique, sorted) and dropped after the retention
+    # window, so loading costs only the volume of the days being asked about.
+
+    _FIELDS = 5  # rcept_no, sent_at, chat_id, report_type, amount
+
+    def __init__(self, directory=SENT_LOG_DIR, retention_days=SENT_LOG_RETENTION_DAYS,
+                 legacy_json=LEGACY_JSON_FILE):
+        self.directory = directory
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._days = {}  # day -> (log size when read, set of (rcept_no, chat_id))
+        self._compacted_on = None
+        os.makedirs(directory, exist_ok=True)
+        if legacy_json:
+            self.migrate_json(legacy_json)
+        self.compact()
+
+    def _day_path(self, day, suffix):
+        return os.path.join(self.directory, f"{day}.{suffix}")
+
+    def migrate_json(self, path):
+        marker = os.path.join(self.directory, ".migrated_json")
+        if os.path.exists(marker) or not os.path.exists(path):
+            return 0
+        rcept_nos = _read_legacy_json(path)
+        self.mark_sent([(rcp, None, None) for rcp in rcept_nos])  # DEFAULT_CHAT_ID
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write(path)
+        print(f"Migrated {len(rcept_nos)} rcept_nos from {path} to {self.directory}")
+        return len(rcept_nos)
+
+    def _read_lines(self, path):
+        # {(rcept_no, chat_id): first line recording it}
+        lines = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    # a torn last line from an interrupted append is ignored
+                    if len(fields) == self._FIELDS and line.endswith('\n'):
+                        lines.setdefault(_split_key(fields[0], fields[2]), line)
+        except FileNotFoundError:
+            pass
+        return lines
+
+    def _load_day(self, day):
+        log_path = self._day_path(day, "log")
+        try:
+            size = os.path.getsize(log_path)
+        except OSError:
+            size = -1
+        cached = self._days.get(day)
+        if cached is not None and cached[0] == size:
+            return cached[1]
+        keys = set(self._read_lines(self._day_path(day, "sent"))) | set(self._read_lines(log_path))
+        self._days[day] = (size, keys)
+        return keys
+
+    def sent(self, keys):
+        found = set()
+        with self._lock:
+            for rcept_no, chat_id in keys:
+                key = (rcept_no, _chat(chat_id))
+                if key in self._load_day(_day_of(rcept_no)):
+                    found.add(key)
+        return found
+
+    def mark_sent(self, entries, chat_id=None):
+        # One O_APPEND write per day file, fsynced, so concurrent writers never interleave lines
+        now = int(time.time())
+        by_day = {}
+        for rcept_no, report_type, amount in entries:
+            fields = [rcept_no, now, _chat(chat_id), report_type or '', '' if amount is None else amount]
+            by_day.setdefault(_day_of(rcept_no), []).append('\t'.join(str(v) for v in fields) + '\n')
+        with self._lock:
+            for day, lines in by_day.items():
+                fd = os.open(self._day_path(day, "log"), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    data = ''.join(lines).encode('utf-8')
+                    size = os.fstat(fd).st_size
+                    if size and os.pread(fd, 1, size - 1) != b'\n':
+                        # end a torn line left by an interrupted append, or it swallows our first line
+                        data = b'\n' + data
+                    os.write(fd, data)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                self._days.pop(day, None)
+        if self._compacted_on != datetime.now(korea_tz).strftime('%Y%m%d'):
+            self.compact()
+
+    def compact(self):
+        # Fold finished days' logs into <day>.sent and drop days past retention
+        today = datetime.now(korea_tz).strftime('%Y%m%d')
+        cutoff = (datetime.now(korea_tz) - timedelta(days=self.retention_days)).strftime('%Y%m%d')
+        self._compacted_on = today
+        with self._lock:
+            for name in os.listdir(self.directory):
+                day, _, suffix = name.partition('.')
+                if suffix not in ('log', 'sent') or not day.isdigit():
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    if day < cutoff:
+                        os.remove(path)
+                        self._days.pop(day, None)
+                    elif day < today and suffix == 'log':
+                        lines = self._read_lines(self._day_path(day, "sent"))
+                        for key, line in self._read_lines(path).items():
+                            lines.setdefault(key, line)
+                        tmp = self._day_path(day, "sent.tmp")
+                        with open(tmp, 'w', encoding='utf-8') as f:
+                            f.writelines(lines[key] for key in sorted(lines))
+                            f.flush()
+                            os.fsync(f.fileno())
+                        os.replace(tmp, self._day_path(day, "sent"))
+                        os.remove(path)
+                        self._days.pop(day, None)
+                except OSError as e:
+                    print(f"Error compacting sent log {name}: {e}")
+
+
+class InMemoryObjectStore:
+    # Local fake of a generation-versioned object store (Cloud Storage semantics):
+    # generation 0 means "does not exist" and every write bumps the generation.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}  # name -> (data, generation)
+        self._next_generation = 1
+
+    def generation(self, name):
+        with self._lock:
+            return self._objects.get(name, (None, 0))[1]
+
+    def read(self, name):
+        with self._lock:
+            return self._objects.get(name, (None, 0))
+
+    def write(self, name, data, if_generation_match):
+        with self._lock:
+            if self._objects.get(name, (None, 0))[1] != if_generation_match:
+                raise StateConflict(name)
+            generation = self._next_generation
+            self._next_generation += 1
+            self._objects[name] = (data, generation)
+            return generation
+
+
+class FileObjectStore:
+    # Directory-backed object store with the same generation semantics, for
+    # processes sharing one host. Each object is "<generation>\n<data>" and writes
+    # are serialised with flock on a sidecar lock file.
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name.replace('/', '_'))
+
+    def _read_locked(self, path):
+        try:
+            with open(path, 'rb') as f:
+                generation, _, data = f.read().partition(b'\n')
+            return data, int(generation)
+        except FileNotFoundError:
+            return None, 0
+
+    def generation(self, name):
+        return self.read(name)[1]
+
+    def read(self, name):
+        path = self._path(name)
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            return self._read_locked(path)
+
+    def write(self, name, data, if_generation_match):
+        path = self._path(name)
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            generation = self._read_locked(path)[1]
+            if generation != if_generation_match:
+                raise StateConflict(name)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(b'%d\n' % (generation + 1) + data)
+            os.replace(tmp, path)
+            return generation + 1
+
+
+class GCSObjectStore:
+    # Cloud Storage bucket with the InMemoryObjectStore interface
+
+    def __init__(self, bucket_name):
+        try:
+            from google.cloud import storage
+            from google.api_core.exceptions import PreconditionFailed
+        except ImportError as e:
+            raise RuntimeError("STATE_BACKEND=gcs requires the google-cloud-storage package") from e
+        self._precondition_failed = PreconditionFailed
+        self._bucket = storage.Client().bucket(bucket_name)
+
+    def generation(self, name):
+        blob = self._bucket.get_blob(name)
+        return blob.generation if blob is not None else 0
+
+    def read(self, name):
+        blob = self._bucket.get_blob(name)
+        if blob is None:
+            return None, 0
+        try:
+            return blob.download_as_bytes(if_generation_match=blob.generation), blob.generation
+        except self._precondition_failed:
+            # replaced between metadata and download; read whatever is current now
+            return self.read(name)
+
+    def write(self, name, data, if_generation_match):
+        blob = self._bucket.blob(name)
+        try:
+            blob.upload_from_string(data, content_type="application/json", if_generation_match=if_generation_match)
+        except self._precondition_failed as e:
+            raise StateConflict(name) from e
+        return blob.generation
+
+
+class ObjectStorageStateBackend(StateBackend):
+    # One JSON object per KST day, {rcept_no: {chat_id: [sent_at, report_type, amount]}}.
+    # Reads reuse the cached copy while the object's generation is unchanged, so warm
+    # state costs one metadata request; writes merge into the latest generation and
+    # only succeed if nobody else wrote in between, retrying on conflict.
+
+    def __init__(self, store, prefix=STATE_PREFIX, max_attempts=5):
+        self.store = store
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._days = {}  # day -> (generation, records)
+
+    def _name(self, day):
+        return f"{self.prefix}{day}.json"
+
+    def _load_day(self, day):
+        name = self._name(day)
+        cached = self._days.get(day)
+        if cached is not None and cached[0] == self.store.generation(name):
+            return cached
+        data, generation = self.store.read(name)
+        records = {}
+        for key, value in (json.loads(data) if data else {}).items():
+            if isinstance(value, list):
+                # earlier format: {rcept_no or "rcept_no:chat_id": [sent_at, chat_id, report_type, amount]}
+                rcept_no, chat_id = _split_key(key, value[1])
+                records.setdefault(rcept_no, {})[chat_id] = [value[0]] + value[2:]
+            else:
+                records.setdefault(key, {}).update(value)
+        self._days[day] = (generation, records)
+        return self._days[day]
+
+    def sent(self, keys):
+        by_day = {}
+        for rcept_no, chat_id in keys:
+            by_day.setdefault(_day_of(rcept_no), []).append((rcept_no, _chat(chat_id)))
+        found = set()
+        with self._lock:
+            for day, day_keys in by_day.items():
+                records = self._load_day(day)[1]
+                found.update(key for key in day_keys if key[1] in records.get(key[0], ()))
+        return found
+
+    def mark_sent(self, entries, chat_id=None):
+        now = int(time.time())
+        chat_id = _chat(chat_id)
+        by_day = {}
+        for rcept_no, report_type, amount in entries:
+            by_day.setdefault(_day_of(rcept_no), {})[rcept_no] = [now, report_type, amount]
+        with self._lock:
+            for day, new_records in by_day.items():
+                for attempt in range(self.max_attempts):
+                    generation, records = self._load_day(day)
+                    merged = dict(records)
+                    for rcept_no, record in new_records.items():
+                        merged[rcept_no] = dict(merged.get(rcept_no, {}), **{chat_id: record})
+                    data = json.dumps(merged, ensure_ascii=False).encode('utf-8')
+                    try:
+                        generation = self.store.write(self._name(day), data, if_generation_match=generation)
+                    except StateConflict:
+                        print(f"State conflict on {self._name(day)}, retrying ({attempt + 1}/{self.max_attempts})")
+                        self._days.pop(day, None)
+                        time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+                        continue
+                    self._days[day] = (generation, merged)
+                    break
+                else:
+                    raise StateConflict(self._name(day))
+
+
+def _day_of(rcept_no):
+    # rcept_no starts with the KST filing date (YYYYMMDD)
+    day = rcept_no[:8]
+    return day if day.isdigit() else datetime.now(korea_tz).strftime('%Y%m%d')
+
+
+def _read_legacy_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        rcept_nos = json.loads(content) if content else []
+    except Exception as e:
+        print(f"Error migrating {path}: {e}")
+        return []
+    return [rcp for rcp in rcept_nos if isinstance(rcp, str)]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_store(backend=STATE_BACKEND):
+    if backend == "file":
+        return FileSentLog()
+    if backend == "gcs":
+        if not STATE_BUCKET:
+            raise RuntimeError("STATE_BACKEND=gcs requires STATE_BUCKET")
+        return ObjectStorageStateBackend(GCSObjectStore(STATE_BUCKET))
+    if backend == "memory":
+        return ObjectStorageStateBackend(InMemoryObjectStore())
+    return SQLiteStateStore()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = create_store()
+        return _store
+
+
+def set_store(store):
+    # Swap the process-wide backend, e.g. for an ObjectStorageStateBackend over a fake
+    global _store
+    with _store_lock:
+        _store = store
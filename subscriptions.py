@@ -0,0 +1,188 @@
+import json
+import os
+import random
+import threading
+import time
+
+import state
+
+# Subscriber chats and their filters. Each chat may narrow what it receives by
+# bond type (BW/CB/EB), minimum amount in 억 and a watchlist of corp names; an
+# empty filter matches everything.
+# The registry is one JSON object, {chat_id: {'types', 'min_amount', 'corps'}},
+# in the same object store as the run lease (Cloud Storage with STATE_BACKEND=gcs,
+# otherwise SUBSCRIPTIONS_DIR), written with generation-matched updates. The
+# default chat gets everything while it has no entry; once it unsubscribes its
+# entry is null so that it stays unsubscribed.
+# For matching, all filters are compiled into a FilterIndex of inverted indexes,
+# so a filing costs a few dict lookups and one set intersection instead of a pass
+# over every filter. The index is rebuilt only when the registry changes.
+
+SUBSCRIPTIONS_DIR = os.getenv("SUBSCRIPTIONS_DIR", ".subscriptions")
+SUBSCRIPTIONS_NAME = os.getenv("SUBSCRIPTIONS_NAME", "dart_bot/subscriptions.json")
+BOND_TYPES = ('BW', 'CB', 'EB')
+
+
+def normalize_corp(name):
+    return ''.join(name.split()).replace('(주)', '').replace('㈜', '')
+
+
+class Subscription:
+    def __init__(self, chat_id, types=(), min_amount=0, corps=()):
+        self.chat_id = str(chat_id)
+        self.types = sorted(set(types))
+        self.min_amount = float(min_amount or 0)
+        self.corps = sorted({normalize_corp(corp) for corp in corps})
+
+    def to_dict(self):
+        return {'types': self.types, 'min_amount': self.min_amount, 'corps': self.corps}
+
+    @classmethod
+    def from_dict(cls, chat_id, data):
+        return cls(chat_id, data.get('types', ()), data.get('min_amount', 0), data.get('corps', ()))
+
+    def matches(self, report_type, corp_name, amount):
+        # Plain predicate; FilterIndex gives the same answer for all chats at once
+        return ((not self.types or report_type in self.types)
+                and (amount or 0) >= self.min_amount
+                and (not self.corps or normalize_corp(corp_name) in self.corps))
+
+
+class FilterIndex:
+    # Inverted indexes over every subscription:
+    #   by_type:   bond type -> chats filtering on it; any_type: chats without a type filter
+    #   by_corp:   normalized corp name -> chats watching it; any_corp: chats without a watchlist
+    #   minimums:  chat -> minimum amount, checked on the chats left after the intersection
+
+    def __init__(self, subscriptions):
+        self.size = len(subscriptions)
+        self.by_type = {}
+        self.any_type = set()
+        self.by_corp = {}
+        self.any_corp = set()
+        self.minimums = {}
+        for sub in subscriptions:
+            if sub.types:
+                for bond_type in sub.types:
+                    self.by_type.setdefault(bond_type, set()).add(sub.chat_id)
+            else:
+                self.any_type.add(sub.chat_id)
+            if sub.corps:
+                for corp in sub.corps:
+                    self.by_corp.setdefault(corp, set()).add(sub.chat_id)
+            else:
+                self.any_corp.add(sub.chat_id)
+            self.minimums[sub.chat_id] = sub.min_amount
+
+    def match(self, report_type, corp_name, amount):
+        # Chat ids whose filter accepts the filing (report_type may be '' for other reports)
+        typed = self.by_type.get(report_type)
+        type_chats = self.any_type | typed if typed else self.any_type
+        watching = self.by_corp.get(normalize_corp(corp_name))
+        corp_chats = self.any_corp | watching if watching else self.any_corp
+        amount = amount or 0
+        return {chat_id for chat_id in type_chats & corp_chats if self.minimums[chat_id] <= amount}
+
+
+class SubscriptionRegistry:
+    def __init__(self, store, name=SUBSCRIPTIONS_NAME, default_chat_id=None, max_attempts=5):
+        # default_chat_id: chat that receives everything while it has no entry of its own
+        self.store = store
+        self.name = name
+        self.default_chat_id = str(default_chat_id) if default_chat_id else None
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._cached = None  # (generation, {chat_id: Subscription} as stored, FilterIndex)
+
+    def _load(self):
+        generation = self.store.generation(self.name)
+        if self._cached is not None and self._cached[0] == generation:
+            return self._cached
+        data, generation = self.store.read(self.name)
+        raw = json.loads(data) if data else {}
+        subs = {chat_id: None if entry is None else Subscription.from_dict(chat_id, entry)
+                for chat_id, entry in raw.items()}
+        self._cached = (generation, subs, FilterIndex(list(self._with_default(subs).values())))
+        return self._cached
+
+    def _with_default(self, subs):
+        # Active subscriptions: drops opt-out markers, adds the default chat if it has no entry
+        active = {chat_id: sub for chat_id, sub in subs.items() if sub is not None}
+        if self.default_chat_id and self.default_chat_id not in subs:
+            active[self.default_chat_id] = Subscription(self.default_chat_id)
+        return active
+
+    def all(self):
+        with self._lock:
+            return self._with_default(self._load()[1])
+
+    def get(self, chat_id):
+        return self.all().get(str(chat_id))
+
+    def index(self):
+        with self._lock:
+            return self._load()[2]
+
+    def update(self, chat_id, change):
+        # change(Subscription or None) -> Subscription, or None to unsubscribe; returns the result
+        chat_id = str(chat_id)
+        with self._lock:
+            for attempt in range(self.max_attempts):
+                generation, subs, _ = self._load()
+                updated = change(self._with_default(subs).get(chat_id))
+                raw = {cid: None if sub is None else sub.to_dict() for cid, sub in subs.items() if cid != chat_id}
+                if updated is not None:
+                    raw[chat_id] = updated.to_dict()
+                elif chat_id == self.default_chat_id:
+                    raw[chat_id] = None
+                data = json.dumps(raw, ensure_ascii=False).encode('utf-8')
+                try:
+                    self.store.write(self.name, data, if_generation_match=generation)
+                except state.StateConflict:
+                    self._cached = None
+                    time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+                    continue
+                return updated
+            raise state.StateConflict(self.name)
+
+    def subscribe(self, chat_id):
+        return self.update(chat_id, lambda sub: sub or Subscription(chat_id))
+
+    def unsubscribe(self, chat_id):
+        self.update(chat_id, lambda sub: None)
+
+    def set_min_amount(self, chat_id, amount):
+        return self.update(chat_id, lambda sub: Subscription(
+            chat_id, sub.types if sub else (), amount, sub.corps if sub else ()))
+
+    def set_types(self, chat_id, types):
+        return self.update(chat_id, lambda sub: Subscription(
+            chat_id, types, sub.min_amount if sub else 0, sub.corps if sub else ()))
+
+    def set_corps(self, chat_id, corps):
+        return self.update(chat_id, lambda sub: Subscription(
+            chat_id, sub.types if sub else (), sub.min_amount if sub else 0, corps))
+
+
+def registry_store():
+    if state.STATE_BACKEND == "gcs" and state.STATE_BUCKET:
+        return state.GCSObjectStore(state.STATE_BUCKET)
+    return state.FileObjectStore(SUBSCRIPTIONS_DIR)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(default_chat_id=None):
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SubscriptionRegistry(registry_store(), default_chat_id=default_chat_id)
+        return _registry
+
+
+def set_registry(registry):
+    global _registry
+    with _registry_lock:
+        _registry = registry
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import random
+import threading
+
+from dart_quota import TokenBucket
+
+# Outbound Telegram messages.
+# - Long messages are split at entry boundaries to stay under MAX_MESSAGE_CHARS.
+# - Sends are paced by a process-wide bucket and one bucket per chat.
+# - 429 answers are retried after their retry_after; network errors and 5xx are
+#   retried with jittered backoff. Other errors (bad chat id, bot blocked) are final.
+# - Each queued message resolves to SENT once Telegram acknowledged it, REJECTED when
+#   Telegram refused it for good and UNDELIVERED when the retries ran out.
+
+MAX_MESSAGE_CHARS = 4096
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # messages/second, all chats
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # messages/second per chat
+SEND_ATTEMPTS = int(os.getenv("TELEGRAM_SEND_ATTEMPTS", "5"))
+MAX_RETRY_AFTER = float(os.getenv("TELEGRAM_MAX_RETRY_AFTER", "120"))
+RETRY_BASE = 1.0
+RETRY_MAX = 30.0
+
+# Outcomes a queued message resolves to. Only UNDELIVERED is worth sending again later;
+# a REJECTED message (bot blocked, chat not found) would be refused again.
+SENT = 'sent'
+REJECTED = 'rejected'
+UNDELIVERED = 'undelivered'
+
+_global_bucket = TokenBucket(GLOBAL_RATE, max(1, int(GLOBAL_RATE)))
+_chat_buckets = {}
+_lock = threading.Lock()
+_stats = {"sent": 0, "retries": 0, "rate_limited": 0, "rejected": 0, "failed": 0}
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def stats():
+    with _lock:
+        return dict(_stats)
+
+
+def _chat_bucket(chat_id):
+    with _lock:
+        bucket = _chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = _chat_buckets[chat_id] = TokenBucket(CHAT_RATE, 1)
+        return bucket
+
+
+def _reserve(chat_id):
+    # Seconds to wait for both the global and the chat's token
+    return max(_global_bucket.reserve(), _chat_bucket(chat_id).reserve())
+
+
+def split_entries(header, entries, line=str, separator="\n\n", limit=MAX_MESSAGE_CHARS):
+    # -> [(text, entries in that text)]; every chunk starts with header and only
+    # whole entries are put in a chunk (an entry too long on its own is truncated)
+    chunks = []
+    current, text = [], header
+    for entry in entries:
+        piece = line(entry)[:limit - len(header)]
+        candidate = text + separator + piece if current else text + piece
+        if current and len(candidate) > limit:
+            chunks.append((text, current))
+            current, candidate = [], header + piece
+        current.append(entry)
+        text = candidate
+    if current:
+        chunks.append((text, current))
+    return chunks
+
+
+def _outcome(reply):
+    # Telegram reply -> ('ok' | 'retry_after' | 'retry' | 'fail', seconds or description)
+    if reply.get('ok'):
+        return 'ok', None
+    retry_after = (reply.get('parameters') or {}).get('retry_after')
+    if retry_after is not None:
+        return 'retry_after', float(retry_after)
+    if (reply.get('error_code') or 500) >= 500:
+        return 'retry', reply.get('description')
+    return 'fail', reply.get('description')
+
+
+def _backoff(attempt):
+    return random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+
+
+def _send_url(bot_token):
+    return f"https://api.telegram.org/bot{bot_token}/sendMessage"
+
+
+class SendQueue:
+    # Async queue bound to one event loop and AsyncClient. Each chat has its own FIFO
+    # drained by one worker, so a chat's messages arrive in order; the rate buckets
+    # are shared with every other queue in the process.
+
+    def __init__(self, client, bot_token):
+        self.client = client
+        self.url = _send_url(bot_token)
+        self._queues = {}
+        self._workers = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def submit(self, chat_id, text, on_ack=None):
+        # Returns a future resolving to SENT, REJECTED or UNDELIVERED;
+        # on_ack() runs in the loop's default executor right after the acknowledgement
+        # (it usually writes sent state) and the future resolves once it has returned
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = asyncio.Queue()
+            self._workers.append(asyncio.ensure_future(self._worker(chat_id, queue)))
+        queue.put_nowait((text, on_ack, future))
+        return future
+
+    async def close(self):
+        # Waits until every queued message is sent or given up on
+        for queue in list(self._queues.values()):
+            await queue.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queues, self._workers = {}, []
+
+    async def _worker(self, chat_id, queue):
+        while True:
+            text, on_ack, future = await queue.get()
+            try:
+                outcome = await self._deliver(chat_id, text)
+                if outcome == SENT and on_ack:
+                    await asyncio.get_running_loop().run_in_executor(None, on_ack)
+                future.set_result(outcome)
+            except Exception as e:
+                print(f"Error sending Telegram message to {chat_id}: {e!r}")
+                if not future.done():
+                    future.set_result(UNDELIVERED)
+            finally:
+                queue.task_done()
+
+    async def _deliver(self, chat_id, text):
+        error = None
+        for attempt in range(SEND_ATTEMPTS):
+            await asyncio.sleep(_reserve(chat_id))
+            try:
+                reply = json.loads(await self.client.post(self.url, data={"chat_id": chat_id, "text": text}))
+                kind, detail = _outcome(reply)
+            except Exception as e:
+                kind, detail = 'retry', repr(e)
+            if kind == 'ok':
+                _count("sent")
+                return SENT
+            if kind == 'fail':
+                _count("rejected")
+                print(f"Telegram rejected the message to {chat_id}: {detail}")
+                return REJECTED
+            if kind == 'retry_after' and detail > MAX_RETRY_AFTER:
+                break
+            error = detail
+            _count("rate_limited" if kind == 'retry_after' else "retries")
+            await asyncio.sleep(detail if kind == 'retry_after' else _backoff(attempt))
+        _count("failed")
+        print(f"Error sending Telegram message to {chat_id}: {detail or error}")
+        return UNDELIVERED
@@ -0,0 +1,112 @@
+import io
+import zipfile
+
+import pytest
+
+import filing_parser
+
+bs4 = pytest.importorskip("bs4")
+
+
+def old_extract_bond_amount(text):
+    # The BeautifulSoup extractor the streaming parser replaced
+    soup = bs4.BeautifulSoup(text, 'html.parser')
+    first_table = next((t for t in soup.find_all('table') if '권면' in t.get_text()), None)
+    if first_table is None:
+        return None
+    for tr in first_table.find_all('tr'):
+        if '사채의 권면(전자등록)총액' in tr.get_text(' ', strip=True):
+            value_elem = tr.find(lambda tag: tag.name in ['te', 'td', 'th'] and (
+                tag.get('acode') == 'DNM_SUM' or tag.get('align', '').upper() == 'RIGHT'))
+            if value_elem is None:
+                cells = tr.find_all(['te', 'td', 'th'])
+                if cells:
+                    value_elem = cells[-1]
+            if value_elem is not None:
+                return value_elem.get_text(strip=True)
+            return None
+    return None
+
+
+DOCUMENTS = [
+    # DART layout: the value cell is marked with ACODE / ALIGN
+    "<table><tr><td>1. 사채의 종류</td><td>x</td></tr></table>"
+    "<table><tr><td>권면</td></tr><tr><td>2. 사채의 권면(전자등록)총액 (원)</td>"
+    "<te ACODE='DNM_SUM' ALIGN='RIGHT'> 12,000,000,000 </te></tr></table>",
+    # no marked cell: the last cell is used
+    "<table><tr><th>권면 기준</th></tr><tr><td>사채의 권면(전자등록)총액</td><td>3,000,000,000</td></tr></table>",
+    # label split over several text nodes, surrounded by whitespace
+    "<table><tr><td>\n  사채의 권면(전자등록)총액\n</td><td>\n 1,500,000,000 \n</td>"
+    "<td align='right'>\n 2,500,000,000\n</td></tr><tr><td>권면</td></tr></table>",
+    # the first '권면' table has no amount row, a later one does
+    "<table><tr><td>권면 이자율</td><td>0%</td></tr></table>"
+    "<table><tr><td>사채의 권면(전자등록)총액</td><td>9</td></tr></table>",
+    # no '권면' table at all
+    "<table><tr><td>사채의 종류</td><td>CB</td></tr></table>",
+    # entities and a nested table
+    "<table><tr><td>권&#47732;</td></tr><tr><td><table><tr><td>x</td></tr></table>"
+    "사채의 권면(전자등록)총액</td><td acode='DNM_SUM'>4,&#48;00,000,000</td></tr></table>",
+]
+
+
+@pytest.mark.parametrize("text", DOCUMENTS, ids=[str(i) for i in range(len(DOCUMENTS))])
+def test_matches_old_extractor_at_every_chunk_boundary(text, monkeypatch):
+    expected = old_extract_bond_amount(text)
+    for chunk_size in range(1, len(text) + 1):
+        monkeypatch.setattr(filing_parser, 'CHUNK_SIZE', chunk_size)
+        assert filing_parser.extract_bond_amount(text) == expected, chunk_size
+        assert filing_parser.extract_bond_amount_bytes(text.encode('utf-8'), 'utf-8') == expected, chunk_size
+        assert filing_parser.extract_bond_amount_bytes(text.encode('cp949'), 'cp949') == expected, chunk_size
+
+
+def test_label_across_default_chunk_boundary():
+    # a real filing is far longer than CHUNK_SIZE; put the label across the first feed boundary
+    label = '사채의 권면(전자등록)총액'
+    head = "<table><tr><td>권면</td></tr><tr><td>"
+    for split in range(1, len(label)):
+        padding = 'x' * (filing_parser.CHUNK_SIZE - len("<p></p>") - len(head) - split)
+        text = (f"<p>{padding}</p>{head}{label}</td>"
+                f"<td align='right'>7,000,000,000</td></tr></table>")
+        assert text[filing_parser.CHUNK_SIZE - split:filing_parser.CHUNK_SIZE + 1].startswith(label[:split])
+        assert filing_parser.extract_bond_amount(text) == old_extract_bond_amount(text) == '7,000,000,000'
+        assert filing_parser.extract_bond_amount_bytes(text.encode('utf-8'), 'utf-8') == '7,000,000,000'
+
+
+def test_parse_document_amounts():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr('a.xml', DOCUMENTS[0].encode('utf-8'))
+        zf.writestr('b.xml', DOCUMENTS[1].encode('cp949'))
+        zf.writestr('c.xml', '<p>첨부</p>'.encode('cp949'))
+    assert filing_parser.parse_document(buffer.getvalue()) == ([120.0, 30.0], None)
+    assert filing_parser.parse_document(b'not a zip') == ([], 'bad_zip')
+
+
+def test_dart_status_bodies_get_their_own_reason():
+    throttled = b'<?xml version="1.0" encoding="UTF-8"?><result><status>020</status><message>limit</message></result>'
+    assert filing_parser.parse_document(throttled) == ([], 'dart_020')
+    assert filing_parser.is_transient('dart_020')
+    assert filing_parser.is_transient('dart_800')
+    assert not filing_parser.is_transient('dart_014')
+    assert not filing_parser.is_transient('bad_zip')
+    assert not filing_parser.is_transient(None)
+
+
+def test_parse_pool_matches_in_process_parsing(monkeypatch):
+    monkeypatch.setattr(filing_parser, 'PARSE_WORKERS', 2)
+    assert filing_parser.parse_executor(filing_parser.PARSE_POOL_MIN_BATCH - 1) is None
+    documents = []
+    for text in DOCUMENTS:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr('a.xml', text.encode('cp949'))
+        documents.append(buffer.getvalue())
+    pool = filing_parser.parse_executor(filing_parser.PARSE_POOL_MIN_BATCH)
+    try:
+        assert filing_parser.parse_executor(filing_parser.PARSE_POOL_MIN_BATCH) is pool
+        futures = [pool.submit(filing_parser.extract_filing, str(i), 'CB', content) for i, content in enumerate(documents)]
+        assert [future.result() for future in futures] == [
+            filing_parser.extract_filing(str(i), 'CB', content) for i, content in enumerate(documents)]
+    finally:
+        filing_parser.shutdown_pool()
+    assert filing_parser._pool is None
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+
+import pytest
+
+import run_lock
+import state
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(run_lock.time, 'time', lambda: now[0])
+    return now
+
+
+def test_single_flight_shares_one_run():
+    flight = run_lock.SingleFlight()
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def main():
+        results = await asyncio.gather(*(flight.run_async(run) for _ in range(5)))
+        return results, await flight.run_async(run)
+
+    results, again = asyncio.run(main())
+    assert sorted(results) == [(1, False)] + [(1, True)] * 4
+    # a trigger after the run finished starts a new one
+    assert again == (2, False)
+
+
+def test_single_flight_shares_across_event_loops():
+    flight = run_lock.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    async def run():
+        calls.append(1)
+        started.set()
+        await asyncio.get_running_loop().run_in_executor(None, release.wait)
+        return 'done'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(asyncio.run(flight.run_async(run))))
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(asyncio.run(flight.run_async(run))))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert sorted(results) == [('done', False), ('done', True)]
+    assert len(calls) == 1
+
+
+def test_single_flight_passes_the_error_to_followers():
+    flight = run_lock.SingleFlight()
+
+    async def run():
+        await asyncio.sleep(0.05)
+        raise RuntimeError('boom')
+
+    async def main():
+        return await asyncio.gather(flight.run_async(run), flight.run_async(run), return_exceptions=True)
+
+    assert [type(result) for result in asyncio.run(main())] == [RuntimeError, RuntimeError]
+    # the failed run does not stick
+    assert asyncio.run(flight.run_async(lambda: asyncio.sleep(0, 'ok'))) == ('ok', False)
+
+
+def test_lease_is_exclusive_until_it_expires(clock):
+    store = state.InMemoryObjectStore()
+    first = run_lock.LeaseLock(store, ttl=300)
+    second = run_lock.LeaseLock(store, ttl=300)
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    # the holder may take its own lease again
+    assert first.try_acquire()
+
+    clock[0] += 299
+    assert first.renew()
+    clock[0] += 299
+    assert not second.try_acquire()
+
+    # a holder that stopped renewing loses the lease once it expires
+    clock[0] += 2
+    assert second.try_acquire()
+    assert not first.renew()
+    assert not first.try_acquire()
+    first.release()  # no longer the holder: must not clear second's lease
+    assert not first.try_acquire()
+
+    second.release()
+    assert first.try_acquire()
+
+
+def test_acquire_async_waits_for_release(monkeypatch):
+    monkeypatch.setattr(run_lock, 'RUN_LOCK_POLL', 0.01)
+    store = state.InMemoryObjectStore()
+    holder = run_lock.LeaseLock(store)
+    waiter = run_lock.LeaseLock(store)
+    assert holder.try_acquire()
+
+    async def main():
+        timed_out = await waiter.acquire_async(timeout=0.05)
+        asyncio.get_running_loop().call_later(0.05, holder.release)
+        return timed_out, await waiter.acquire_async(timeout=5)
+
+    (timed_out, _), (acquired, waited) = asyncio.run(main())
+    assert not timed_out
+    assert acquired and waited >= 0.04
+
+
+def test_hold_async_renews_and_releases():
+    store = state.InMemoryObjectStore()
+    lock = run_lock.LeaseLock(store, ttl=0.06)
+    other = run_lock.LeaseLock(store, ttl=0.06)
+    assert lock.try_acquire()
+    first_generation = store.generation(lock.name)
+
+    async def work():
+        await asyncio.sleep(0.1)
+        # renewed by the heartbeat, still held
+        assert store.generation(lock.name) != first_generation
+        assert not other.try_acquire()
+        return 'result'
+
+    assert asyncio.run(lock.hold_async(work())) == 'result'
+    assert other.try_acquire()
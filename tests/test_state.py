@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import state
+
+
+@pytest.fixture(autouse=True)
+def default_chat(monkeypatch):
+    monkeypatch.setattr(state, 'DEFAULT_CHAT_ID', '100')
+    monkeypatch.setattr(state.time, 'sleep', lambda seconds: None)
+
+
+def day(offset=0):
+    return (datetime.now(state.korea_tz) + timedelta(days=offset)).strftime('%Y%m%d')
+
+
+class RacingStore(state.InMemoryObjectStore):
+    # Runs race() right before a write, as if another instance wrote first
+    def __init__(self):
+        super().__init__()
+        self.race = None
+        self.writes = 0
+
+    def write(self, name, data, if_generation_match):
+        race, self.race = self.race, None
+        if race:
+            race()
+        self.writes += 1
+        return super().write(name, data, if_generation_match)
+
+
+def test_split_key_reads_older_formats():
+    assert state._split_key('20251020000001', '7') == ('20251020000001', '7')
+    assert state._split_key('20251020000001:9') == ('20251020000001', '9')
+    assert state._split_key('20251020000001:9', '7') == ('20251020000001', '9')
+    assert state._split_key('20251020000001') == ('20251020000001', '100')
+    assert state._split_key('20251020000001', '') == ('20251020000001', '100')
+
+
+def test_object_storage_merges_on_generation_conflict():
+    store = RacingStore()
+    mine = state.ObjectStorageStateBackend(store)
+    other = state.ObjectStorageStateBackend(store)
+    mine.mark_sent([('20251020000001', 'CB', 5.0)], chat_id='1')
+    store.race = lambda: other.mark_sent([('20251020000001', 'BW', 5.0), ('20251020000002', 'EB', 1.0)], chat_id='2')
+    mine.mark_sent([('20251020000003', 'CB', 2.0)], chat_id='1')
+
+    # the first attempt lost the race, the retry merged into the other instance's write
+    assert store.writes == 4
+    keys = [('20251020000001', '1'), ('20251020000001', '2'), ('20251020000002', '2'), ('20251020000003', '1')]
+    for backend in (mine, other, state.ObjectStorageStateBackend(store)):
+        assert backend.sent(keys + [('20251020000002', '1')]) == set(keys)
+
+
+def test_object_storage_gives_up_after_max_attempts():
+    store = RacingStore()
+    other = state.ObjectStorageStateBackend(store)
+    mine = state.ObjectStorageStateBackend(store, max_attempts=3)
+    raced = []
+
+    def race():
+        raced.append(1)
+        other.mark_sent([(f'2025102000000{len(raced)}', 'CB', 1.0)], chat_id='2')
+        if len(raced) < 3:
+            store.race = race
+    store.race = race
+    with pytest.raises(state.StateConflict):
+        mine.mark_sent([('20251020000009', 'CB', 1.0)], chat_id='1')
+    assert not mine.is_sent('20251020000009', '1')
+
+
+def test_object_storage_reads_legacy_day_objects():
+    store = state.InMemoryObjectStore()
+    legacy = {
+        '20251020000001': [1, None, 'CB', 5.0],
+        '20251020000002': [1, '7', 'BW', 3.0],
+        '20251020000003:9': [1, '9', 'EB', None],
+    }
+    store.write('dart_bot/sent/20251020.json', json.dumps(legacy).encode('utf-8'), if_generation_match=0)
+    backend = state.ObjectStorageStateBackend(store)
+    assert backend.sent([('20251020000001', None), ('20251020000002', '7'), ('20251020000003', '9'),
+                         ('20251020000002', None), ('20251020000003', '100')]) == {
+        ('20251020000001', '100'), ('20251020000002', '7'), ('20251020000003', '9')}
+
+    # the next write stores the day in the per-chat format
+    backend.mark_sent([('20251020000001', 'CB', 5.0)], chat_id='8')
+    data, _ = store.read('dart_bot/sent/20251020.json')
+    assert json.loads(data)['20251020000001'].keys() == {'100', '8'}
+    assert json.loads(data)['20251020000003'] == {'9': [1, 'EB', None]}
+
+
+def test_sqlite_migrates_rcept_no_keyed_table(tmp_path):
+    path = str(tmp_path / 'state.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sent (rcept_no TEXT PRIMARY KEY, sent_at INTEGER, chat_id TEXT,"
+                 " report_type TEXT, amount REAL)")
+    conn.executemany("INSERT INTO sent VALUES (?, ?, ?, ?, ?)", [
+        ('20251020000001', 1, None, 'CB', 5.0),
+        ('20251020000001:9', 2, '9', 'CB', 5.0),
+        ('20251020000002', 3, '7', 'BW', None),
+    ])
+    conn.commit()
+    conn.close()
+
+    store = state.SQLiteStateStore(path, legacy_json=None)
+    assert store.sent([('20251020000001', None), ('20251020000001', '9'), ('20251020000002', '7'),
+                       ('20251020000002', None)]) == {
+        ('20251020000001', '100'), ('20251020000001', '9'), ('20251020000002', '7')}
+    assert store.is_sent('20251020000001', '9')
+    assert not store.is_sent('20251020000002')
+    store.mark_sent([('20251020000002', 'BW', 1.0)])
+    assert store.is_sent('20251020000002')
+    assert store.migrate_chat_key() == 0
+    store.close()
+
+    # reopening does not migrate again
+    store = state.SQLiteStateStore(path, legacy_json=None)
+    assert store.is_sent('20251020000001', '9')
+    store.close()
+
+
+def test_file_log_ignores_torn_and_malformed_lines(tmp_path):
+    today = day()
+    with open(tmp_path / f'{today}.log', 'w', encoding='utf-8') as f:
+        f.write(f'{today}000001\t1\t5\tCB\t5.0\n')
+        f.write(f'{today}000002\t1\t5\n')
+        f.write(f'{today}000003\t1\t5\tCB')
+    log = state.FileSentLog(str(tmp_path), legacy_json=None)
+    assert log.sent([(f'{today}00000{i}', '5') for i in range(1, 4)]) == {(f'{today}000001', '5')}
+
+    # the next append starts on a line of its own; the torn record stays unsent
+    log.mark_sent([(f'{today}000004', 'EB', None)], chat_id='5')
+    assert log.sent([(f'{today}000003', '5'), (f'{today}000004', '5')]) == {(f'{today}000004', '5')}
+
+
+def test_file_log_compacts_finished_days_and_drops_expired_ones(tmp_path):
+    yesterday, expired, today = day(-1), day(-10), day()
+    with open(tmp_path / f'{yesterday}.sent', 'w', encoding='utf-8') as f:
+        f.write(f'{yesterday}000002\t1\t5\tBW\t\n')
+    with open(tmp_path / f'{yesterday}.log', 'w', encoding='utf-8') as f:
+        f.write(f'{yesterday}000003\t2\t5\tCB\t1.0\n')
+        f.write(f'{yesterday}000002\t3\t5\tBW\t\n')
+        f.write(f'{yesterday}000001:9\t4\t9\tCB\t2.0\n')
+        f.write(f'{yesterday}000001\t5\t\tCB\t2.0\n')
+        f.write(f'{yesterday}000004\t6\t5')
+    with open(tmp_path / f'{expired}.sent', 'w', encoding='utf-8') as f:
+        f.write(f'{expired}000001\t1\t5\tCB\t\n')
+    with open(tmp_path / f'{today}.log', 'w', encoding='utf-8') as f:
+        f.write(f'{today}000001\t1\t5\tCB\t\n')
+
+    log = state.FileSentLog(str(tmp_path), retention_days=7, legacy_json=None)
+    assert sorted(os.listdir(tmp_path)) == sorted([f'{yesterday}.sent', f'{today}.log'])
+    with open(tmp_path / f'{yesterday}.sent', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    # unique per (rcept_no, chat_id), the earliest record kept, sorted
+    assert [line.split('\t')[:3] for line in lines] == [
+        [f'{yesterday}000001', '5', ''], [f'{yesterday}000001:9', '4', '9'],
+        [f'{yesterday}000002', '1', '5'], [f'{yesterday}000003', '2', '5']]
+    assert log.sent([(f'{yesterday}000001', '9'), (f'{yesterday}000001', None), (f'{yesterday}000002', '5'),
+                     (f'{yesterday}000004', '5'), (f'{expired}000001', '5'), (f'{today}000001', '5')]) == {
+        (f'{yesterday}000001', '9'), (f'{yesterday}000001', '100'), (f'{yesterday}000002', '5'),
+        (f'{today}000001', '5')}
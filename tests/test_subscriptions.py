@@ -0,0 +1,43 @@
+import random
+
+import state
+import subscriptions
+
+CORPS = ['삼성전자', '(주)에코프로', '㈜카카오', '한화 솔루션', 'LG화학', '셀트리온']
+
+
+def random_subscription(rng, chat_id):
+    return subscriptions.Subscription(
+        chat_id,
+        rng.sample(subscriptions.BOND_TYPES, rng.choice([0, 0, 1, 2, 3])),
+        rng.choice([0, 0, 10, 50, 100, 300]),
+        rng.sample(CORPS, rng.choice([0, 0, 0, 1, 2])))
+
+
+def test_filter_index_matches_like_the_predicate():
+    rng = random.Random(20251020)
+    for _ in range(200):
+        subs = [random_subscription(rng, str(chat_id)) for chat_id in range(rng.randint(0, 30))]
+        index = subscriptions.FilterIndex(subs)
+        for _ in range(30):
+            report_type = rng.choice(subscriptions.BOND_TYPES + ('',))
+            corp = rng.choice(CORPS + ['다른회사', '삼성 전자', '에코프로'])
+            amount = rng.choice([None, 0, 5, 10, 49.9, 50, 100, 250, 1000])
+            expected = {sub.chat_id for sub in subs if sub.matches(report_type, corp, amount)}
+            assert index.match(report_type, corp, amount) == expected, (report_type, corp, amount)
+
+
+def test_default_chat_gets_everything_until_it_unsubscribes():
+    registry = subscriptions.SubscriptionRegistry(state.InMemoryObjectStore(), default_chat_id=1)
+    assert registry.index().match('CB', '삼성전자', 1) == {'1'}
+
+    registry.set_types('2', ['BW'])
+    registry.unsubscribe('1')
+    assert registry.get('1') is None
+    assert set(registry.all()) == {'2'}
+    assert registry.index().match('CB', '삼성전자', 1) == set()
+    assert registry.index().match('BW', '삼성전자', 1) == {'2'}
+
+    registry.subscribe('1')
+    assert registry.index().match('CB', '삼성전자', 1) == {'1'}
+
@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+import pytest
+
+import telegram_sender
+
+
+def test_split_entries_keeps_whole_entries_under_the_limit():
+    header = "HEADER\n"
+    entries = [f"entry {i} " + "x" * (i * 7 % 40) for i in range(60)]
+    chunks = telegram_sender.split_entries(header, entries, limit=200)
+    assert [entry for _, chunk in chunks for entry in chunk] == entries
+    for text, chunk in chunks:
+        assert len(text) <= 200
+        assert text == header + "\n\n".join(chunk)
+
+
+def test_split_entries_line_separator_and_truncation():
+    chunks = telegram_sender.split_entries("H:", [1, 2, 3], line=lambda n: "n" * (n * 4), separator="|", limit=12)
+    assert chunks == [("H:nnnn", [1]), ("H:nnnnnnnn", [2]), ("H:nnnnnnnnnn", [3])]
+    assert telegram_sender.split_entries("H", []) == []
+
+
+@pytest.mark.parametrize("reply, outcome", [
+    ({'ok': True, 'result': {}}, ('ok', None)),
+    ({'ok': False, 'error_code': 429, 'parameters': {'retry_after': 7}}, ('retry_after', 7.0)),
+    ({'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}, ('retry', 'Bad Gateway')),
+    ({'ok': False}, ('retry', None)),
+    ({'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'},
+     ('fail', 'Forbidden: bot was blocked by the user')),
+    ({'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'},
+     ('fail', 'Bad Request: chat not found')),
+])
+def test_outcome(reply, outcome):
+    assert telegram_sender._outcome(reply) == outcome
+
+
+class FakeClient:
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.posts = []
+
+    async def post(self, url, data=None):
+        self.posts.append(data)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return json.dumps(reply).encode()
+
+
+@pytest.fixture(autouse=True)
+def fast(monkeypatch):
+    monkeypatch.setattr(telegram_sender, '_reserve', lambda chat_id: 0)
+    monkeypatch.setattr(telegram_sender, '_backoff', lambda attempt: 0)
+
+
+def send(client, on_ack=None):
+    async def main():
+        async with telegram_sender.SendQueue(client, 'token') as queue:
+            future = queue.submit('1', 'text', on_ack=on_ack)
+        return future.result()
+    return asyncio.run(main())
+
+
+def test_queue_outcomes():
+    acks = []
+    client = FakeClient([ConnectionError('reset'), {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 0}},
+                         {'ok': True}])
+    assert send(client, on_ack=lambda: acks.append(1)) == telegram_sender.SENT
+    assert len(client.posts) == 3 and acks == [1]
+
+    client = FakeClient([{'ok': False, 'error_code': 403, 'description': 'Forbidden'}])
+    assert send(client, on_ack=lambda: acks.append(2)) == telegram_sender.REJECTED
+    assert len(client.posts) == 1 and acks == [1]
+
+    client = FakeClient([{'ok': False, 'error_code': 500}] * telegram_sender.SEND_ATTEMPTS)
+    assert send(client) == telegram_sender.UNDELIVERED
+    assert len(client.posts) == telegram_sender.SEND_ATTEMPTS
+
+    client = FakeClient([{'ok': False, 'error_code': 429,
+                          'parameters': {'retry_after': telegram_sender.MAX_RETRY_AFTER + 1}}])
+    assert send(client) == telegram_sender.UNDELIVERED
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import threading
+from collections import OrderedDict
+
+import dart_bot
+import filing_archive
+import http_client
+import subscriptions
+import telegram_sender
+
+# Telegram bot commands for the POST /telegram webhook in app.py. The route only
+# hands the update to a worker thread and returns; the worker answers from the
+# subscription registry and the filing archive (never from DART) and replies
+# through the rate-limited telegram_sender queue.
+# Replies are sent after the webhook has answered, so like POST /runs this needs
+# "CPU always allocated" on Cloud Run.
+
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", "1000"))
+SEEN_UPDATES = 1000  # update_ids remembered to drop Telegram redeliveries
+
+HELP_TEXT = (
+    "DART 사채 발행 알림 봇\n\n"
+    "/subscribe - 알림 구독\n"
+    "/unsubscribe - 구독 해지\n"
+    "/min 100 - 100억 이상만 알림 (0이면 전체)\n"
+    "/type CB BW - 받을 사채 종류 (all이면 전체)\n"
+    "/watch 회사명 - 관심 회사 추가 (관심 회사가 있으면 해당 회사만 알림)\n"
+    "/unwatch [회사명] - 관심 회사 삭제 (회사명이 없으면 전체 삭제)\n"
+    "/filters - 현재 구독 설정\n"
+    "/today - 오늘 발행내역\n"
+    "/corp 회사명 - 회사의 최근 발행내역"
+)
+
+_lock = threading.Lock()
+_loop = None
+_sender = None
+_pending = 0
+_seen = OrderedDict()
+_tasks = set()  # strong references to updates being processed
+_chat_locks = {}  # chat id -> [asyncio.Lock, updates using it], so a chat's commands run in order
+
+
+def describe(sub):
+    if sub is None:
+        return "구독 중이 아닙니다. /subscribe 로 구독할 수 있습니다."
+    return (f"종류: {', '.join(sub.types) or '전체'}\n"
+            f"최소 금액: {sub.min_amount:g}억\n"
+            f"관심 회사: {', '.join(sub.corps) or '전체'}")
+
+
+def _records_text(header, records, with_date=False):
+    lines = []
+    for record in records:
+        prefix = f"{record['rcept_no'][:4]}-{record['rcept_no'][4:6]}-{record['rcept_no'][6:8]} " if with_date else ""
+        lines.extend(prefix + dart_bot.format_entry(record['corp_name'], record['report_type'], amount, record['rcept_no'])
+                     for amount in record['amounts'])
+    if not lines:
+        return [header + "내역이 없습니다."]
+    return [text for text, _ in telegram_sender.split_entries(header, lines)]
+
+
+def handle_command(chat_id, text):
+    # Replies (list of message texts) to one command from chat_id
+    command, _, args = text.strip().partition(' ')
+    command = command.split('@')[0].lower()
+    args = args.strip()
+    registry = subscriptions.get_registry(dart_bot.CHAT_ID)
+    if command in ('/start', '/help'):
+        return [HELP_TEXT]
+    if command == '/subscribe':
+        return ["구독을 시작했습니다.\n" + describe(registry.subscribe(chat_id))]
+    if command in ('/unsubscribe', '/stop'):
+        registry.unsubscribe(chat_id)
+        return ["구독을 해지했습니다."]
+    if command == '/min':
+        try:
+            amount = float(args.replace(',', '').replace('억', ''))
+        except ValueError:
+            return ["사용법: /min 100 (단위: 억)"]
+        return ["설정했습니다.\n" + describe(registry.set_min_amount(chat_id, max(amount, 0)))]
+    if command == '/type':
+        types = [t.upper() for t in args.replace(',', ' ').split()]
+        if types == ['ALL']:
+            types = []
+        if not args or any(t not in subscriptions.BOND_TYPES for t in types):
+            return ["사용법: /type CB BW EB (또는 /type all)"]
+        return ["설정했습니다.\n" + describe(registry.set_types(chat_id, types))]
+    if command in ('/watch', '/unwatch'):
+        names = [name for name in args.split(',') if name.strip()]
+        if command == '/watch' and not names:
+            return ["사용법: /watch 회사명[, 회사명]"]
+        current = (registry.get(chat_id) or subscriptions.Subscription(chat_id)).corps
+        removed = {subscriptions.normalize_corp(name) for name in names}
+        if command == '/watch':
+            corps = list(current) + names
+        else:
+            corps = [corp for corp in current if names and corp not in removed]
+        return ["설정했습니다.\n" + describe(registry.set_corps(chat_id, corps))]
+    if command == '/filters':
+        return [describe(registry.get(chat_id))]
+    if command == '/today':
+        return _records_text("오늘 발행내역입니다.\n\n", filing_archive.get_archive().day())
+    if command == '/corp':
+        if not args:
+            return ["사용법: /corp 회사명"]
+        records = filing_archive.get_archive().by_corp(args)
+        return _records_text(f"{args} 최근 {filing_archive.ARCHIVE_DAYS}일 발행내역입니다.\n\n", records, with_date=True)
+    return ["알 수 없는 명령입니다.\n\n" + HELP_TEXT]
+
+
+def handle_update(update):
+    # (chat_id, replies) for a command message, otherwise None
+    message = update.get('message') or update.get('edited_message') or {}
+    text = message.get('text') or ''
+    chat = message.get('chat') or {}
+    if not text.startswith('/') or 'id' not in chat:
+        return None
+    chat_id = str(chat['id'])
+    return chat_id, handle_command(chat_id, text)
+
+
+def _ensure_worker():
+    # Worker thread with its own event loop, AsyncClient and send queue, started once
+    global _loop
+    with _lock:
+        if _loop is not None:
+            return _loop
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            global _sender
+            asyncio.set_event_loop(loop)
+            client = loop.run_until_complete(http_client.AsyncClient().__aenter__())
+            _sender = telegram_sender.SendQueue(client, dart_bot.BOT_TOKEN)
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="telegram-webhook", daemon=True).start()
+        ready.wait()
+        _loop = loop
+        return _loop
+
+
+def submit(update):
+    # Called from the webhook request; False when the update is dropped as overload
+    global _pending
+    update_id = update.get('update_id')
+    with _lock:
+        if update_id is not None:
+            if update_id in _seen:
+                return True
+            _seen[update_id] = None
+            while len(_seen) > SEEN_UPDATES:
+                _seen.popitem(last=False)
+        if _pending >= WEBHOOK_MAX_PENDING:
+            _seen.pop(update_id, None)
+            return False
+        _pending += 1
+    loop = _ensure_worker()
+    loop.call_soon_threadsafe(_start, update)
+    return True
+
+
+def _start(update):
+    task = asyncio.ensure_future(_process(update))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _process(update):
+    global _pending
+    chat_id = str(((update.get('message') or update.get('edited_message') or {}).get('chat') or {}).get('id'))
+    entry = _chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            result = await asyncio.get_running_loop().run_in_executor(None, handle_update, update)
+            if result:
+                chat_id, replies = result
+                for text in replies:
+                    _sender.submit(chat_id, text)
+    except Exception as e:
+        print(f"Error handling Telegram update {update.get('update_id')}: {e!r}")
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _chat_locks.pop(chat_id, None)
+        with _lock:
+            _pending -= 1